@@ -1,12 +1,33 @@
 import streamlit as st
-import requests
+import streamlit.components.v1 as components
 import io
-import base64
-from PIL import Image
+import json
 import tempfile
 import os
+import re
+import time
+import uuid
 from datetime import datetime
 
+from astro_enhancer import client, metrics
+from astro_enhancer.batch import BatchItem, zip_batch
+from astro_enhancer.backends import pool
+from astro_enhancer.catalog import catalog
+from astro_enhancer.config import (BATCH_CONCURRENCY, HISTORY_PAGE_SIZE, HISTORY_SHARED, JOB_POLL_INTERVAL,
+                                   JOB_POLL_MAX_INTERVAL, MAGNIFIER_HEIGHT, MAGNIFIER_ZOOM)
+from astro_enhancer.history import enhance_and_record, history
+from astro_enhancer.jobs import jobs
+from astro_enhancer.processing import Processing
+from astro_enhancer.pyramid import pyramids
+from astro_enhancer.rendering import RenderCache
+from astro_enhancer.result_cache import inflight
+from astro_enhancer.scheduler import PRIORITY_NAMES
+from astro_enhancer.session_store import images
+
+# Structured logs and the optional metrics endpoint (both once per process)
+metrics.configure_logging()
+metrics.serve_metrics()
+
 # Set page configuration
 st.set_page_config(
     page_title="Astronomy Image Enhancer",
@@ -15,7 +36,7 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Custom CSS for styling including magnifying glass and space background
+# Custom CSS for styling including space background
 st.markdown("""
 <style>
     body {
@@ -92,27 +113,6 @@ st.markdown("""
         background-color: rgba(10, 20, 50, 0.7);
     }
     
-    /* Image comparison container */
-    .comparison-container {
-        position: relative;
-        overflow: hidden;
-        width: 100%;
-        height: auto;
-        border-radius: 10px;
-    }
-    
-    /* Magnifier glass styling */
-    .img-magnifier-glass {
-        position: absolute;
-        border: 3px solid #5D9CEC;
-        border-radius: 50%;
-        cursor: none;
-        /*Set the size of the magnifier glass:*/
-        width: 150px;
-        height: 150px;
-        box-shadow: 0 0 10px 2px rgba(93, 156, 236, 0.5);
-    }
-    
     .st-emotion-cache-1v0mbdj {
         background-color: rgba(10, 20, 50, 0.7);
     }
@@ -137,163 +137,205 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# JavaScript for magnifying glass functionality
-st.markdown("""
-<script>
-function magnify(imgId, resultImgId, zoom) {
-  var img, glass, w, h, bw;
-  img = document.getElementById(imgId);
-  
-  /* Create magnifier glass: */
-  glass = document.createElement("DIV");
-  glass.setAttribute("class", "img-magnifier-glass");
-  
-  /* Insert magnifier glass: */
-  img.parentElement.insertBefore(glass, img);
-  
-  /* Set background properties for the magnifier glass: */
-  glass.style.backgroundImage = "url('" + document.getElementById(resultImgId).src + "')";
-  glass.style.backgroundRepeat = "no-repeat";
-  glass.style.backgroundSize = (img.width * zoom) + "px " + (img.height * zoom) + "px";
-  
-  /* Set size of glass: */
-  glass.style.width = "150px";
-  glass.style.height = "150px";
-  
-  /* Execute a function when someone moves the magnifier glass over the image: */
-  glass.addEventListener("mousemove", moveMagnifier);
-  img.addEventListener("mousemove", moveMagnifier);
-  
-  /* Also for touch screens: */
-  glass.addEventListener("touchmove", moveMagnifier);
-  img.addEventListener("touchmove", moveMagnifier);
-  
-  function moveMagnifier(e) {
-    var pos, x, y;
-    /* Prevent any other actions that may occur when moving over the image */
-    e.preventDefault();
-    
-    /* Get the cursor's x and y positions: */
-    pos = getCursorPos(e);
-    x = pos.x;
-    y = pos.y;
-    
-    /* Prevent the magnifier glass from being positioned outside the image: */
-    if (x > img.width - (glass.offsetWidth / zoom)) {x = img.width - (glass.offsetWidth / zoom);}
-    if (x < glass.offsetWidth / zoom) {x = glass.offsetWidth / zoom;}
-    if (y > img.height - (glass.offsetHeight / zoom)) {y = img.height - (glass.offsetHeight / zoom);}
-    if (y < glass.offsetHeight / zoom) {y = glass.offsetHeight / zoom;}
-    
-    /* Set the position of the magnifier glass: */
-    glass.style.left = (x - glass.offsetWidth / 2) + "px";
-    glass.style.top = (y - glass.offsetHeight / 2) + "px";
-    
-    /* Display what the magnifier glass "sees": */
-    glass.style.backgroundPosition = "-" + ((x * zoom) - glass.offsetWidth / 2) + "px -" + ((y * zoom) - glass.offsetHeight / 2) + "px";
+# Magnifier: a glass over the original image that draws only the tiles of the
+# enhanced result's pyramid under the cursor (see astro_enhancer/pyramid.py)
+MAGNIFIER_HTML = """
+<style>
+  body { margin: 0; }
+  #wrap { position: relative; display: inline-block; }
+  #base { display: block; max-width: 100%; max-height: __HEIGHT__px; border-radius: 10px; cursor: none; }
+  #glass {
+    position: absolute; display: none; pointer-events: none;
+    border: 3px solid #5D9CEC; border-radius: 50%;
+    box-shadow: 0 0 10px 2px rgba(93, 156, 236, 0.5);
   }
-  
-  function getCursorPos(e) {
-    var a, x = 0, y = 0;
-    e = e || window.event;
-    
-    /* Get the x and y positions of the image: */
-    a = img.getBoundingClientRect();
-    
-    /* Calculate the cursor's x and y coordinates, relative to the image: */
-    x = e.pageX - a.left;
-    y = e.pageY - a.top;
-    
-    /* Consider any page scrolling: */
-    x = x - window.pageXOffset;
-    y = y - window.pageYOffset;
-    return {x : x, y : y};
+</style>
+<div id="wrap">
+  <img id="base" src="__BASE__">
+  <canvas id="glass" width="150" height="150"></canvas>
+</div>
+<script>
+var pyramid = __PYRAMID__;
+var zoom = __ZOOM__;
+var SIZE = 150, MAX_TILES = 96;
+var base = document.getElementById("base");
+var glass = document.getElementById("glass");
+var ctx = glass.getContext("2d");
+var tiles = new Map();
+var cursor = null;
+
+/* Tiles are loaded on first use and kept in a small LRU */
+function tile(level, col, row) {
+  var key = level + "/" + col + "_" + row;
+  var img = tiles.get(key);
+  if (img) {
+    tiles.delete(key);
+  } else {
+    img = new Image();
+    img.onload = draw;
+    img.src = pyramid.url + "/" + key + "." + pyramid.ext;
   }
+  tiles.set(key, img);
+  if (tiles.size > MAX_TILES) tiles.delete(tiles.keys().next().value);
+  return img;
 }
 
-// Function to initialize the magnifying glass when images are loaded
-document.addEventListener('DOMContentLoaded', function() {
-  // Check every second if the images are loaded
-  var checkImagesInterval = setInterval(function() {
-    var origImg = document.getElementById('original-image');
-    var enhancedImg = document.getElementById('enhanced-image');
-    
-    if (origImg && enhancedImg) {
-      clearInterval(checkImagesInterval);
-      setTimeout(function() {
-        magnify("original-image", "enhanced-image", 1);
-      }, 1000); // Small delay to ensure images are fully rendered
+function draw() {
+  if (!cursor) return;
+  /* Full-resolution pixels under the glass, and the coarsest level that still has enough of them */
+  var scale = pyramid.width / base.clientWidth;
+  var span = SIZE / zoom * scale;
+  var level = Math.max(0, Math.min(pyramid.levels.length - 1, Math.floor(Math.log2(span / SIZE))));
+  var factor = Math.pow(2, level);
+  var size = pyramid.levels[level], T = pyramid.tile_size;
+  span /= factor;
+  var x0 = cursor.x * scale / factor - span / 2, y0 = cursor.y * scale / factor - span / 2;
+  var k = SIZE / span;
+
+  ctx.fillStyle = "#000";
+  ctx.fillRect(0, 0, SIZE, SIZE);
+  for (var col = Math.max(0, Math.floor(x0 / T)); col <= Math.min(Math.ceil(size[0] / T) - 1, Math.floor((x0 + span) / T)); col++) {
+    for (var row = Math.max(0, Math.floor(y0 / T)); row <= Math.min(Math.ceil(size[1] / T) - 1, Math.floor((y0 + span) / T)); row++) {
+      var img = tile(level, col, row);
+      if (img.complete && img.naturalWidth) {
+        ctx.drawImage(img, (col * T - x0) * k, (row * T - y0) * k, img.naturalWidth * k, img.naturalHeight * k);
+      }
     }
-  }, 1000);
+  }
+}
+
+function move(e) {
+  e.preventDefault();
+  var point = e.touches ? e.touches[0] : e;
+  var rect = base.getBoundingClientRect();
+  cursor = {x: point.clientX - rect.left, y: point.clientY - rect.top};
+  glass.style.left = (cursor.x - SIZE / 2 - 3) + "px";
+  glass.style.top = (cursor.y - SIZE / 2 - 3) + "px";
+  glass.style.display = "block";
+  requestAnimationFrame(draw);
+}
+
+base.addEventListener("mousemove", move);
+base.addEventListener("touchmove", move);
+base.addEventListener("mouseleave", function() { glass.style.display = "none"; cursor = null; });
+/* The mouse wheel adjusts the zoom */
+base.addEventListener("wheel", function(e) {
+  e.preventDefault();
+  zoom = Math.max(1, Math.min(16, zoom * (e.deltaY < 0 ? 1.25 : 0.8)));
+  requestAnimationFrame(draw);
 });
 </script>
-""", unsafe_allow_html=True)
+"""
 
-# API configuration
-API_URL = "https://248f-132-249-252-216.ngrok-free.app"  # FastAPI server URL
+def magnifier_html(base_url, pyramid, zoom):
+    """Magnifier component over the image at base_url, drawing from pyramid"""
+    return (MAGNIFIER_HTML.replace("__BASE__", base_url)
+            .replace("__PYRAMID__", json.dumps(pyramid))
+            .replace("__ZOOM__", str(zoom))
+            .replace("__HEIGHT__", str(MAGNIFIER_HEIGHT)))
 
 # Functions to interact with the API
 def get_models():
-    """Get available models from the API"""
+    """Get available models from every healthy backend (checked in the background)"""
     try:
-        response = requests.get(f"{API_URL}/models")
-        if response.status_code == 200:
-            return response.json()
-        else:
-            st.error(f"Error fetching models: {response.text}")
-            return []
+        return pool.models()
+    except client.APIError as e:
+        st.error(f"Error fetching models: {e.text}")
+        return []
     except Exception as e:
         st.error(f"Error connecting to API: {str(e)}")
         return []
 
 def get_presets():
-    """Get available presets from the API"""
+    """Get available presets from the API (cached across reruns and sessions)"""
     try:
-        response = requests.get(f"{API_URL}/presets")
-        if response.status_code == 200:
-            return response.json()
-        else:
-            st.error(f"Error fetching presets: {response.text}")
-            return []
+        return catalog.get(f"{pool.primary_url()}/presets")
+    except client.APIError as e:
+        st.error(f"Error fetching presets: {e.text}")
+        return []
     except Exception as e:
         st.error(f"Error connecting to API: {str(e)}")
         return []
 
-def enhance_image(image_file, model_name, preset, custom_prompt, noise_level, scientific_mode):
-    """Send image to API for enhancement"""
-    try:
-        # Create the form data
-        files = {"image": (image_file.name, image_file, "image/png")}
-        data = {
-            "model_name": model_name,
-            "preset": preset,
-            "noise_level": noise_level,
-            "scientific_mode": str(scientific_mode).lower()
-        }
-        
-        # Add custom prompt if it exists
-        if custom_prompt:
-            data["custom_prompt"] = custom_prompt
-            
-        # Make the request
-        response = requests.post(f"{API_URL}/enhance_image", files=files, data=data)
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            st.error(f"Error enhancing image: {response.text}")
-            return None
-    except Exception as e:
-        st.error(f"Error connecting to API: {str(e)}")
-        return None
+def show_enhance_error(error):
+    """Report a failed enhancement job the same way the UI always has"""
+    if isinstance(error, client.APIError):
+        st.error(f"Error enhancing image: {error.text}")
+    elif isinstance(error, client.BackendBusy):
+        st.warning(str(error))
+    else:
+        st.error(f"Error connecting to API: {str(error)}")
 
-def base64_to_image(base64_str):
-    """Convert base64 string to PIL Image"""
-    # Remove data URL prefix if present
-    if "base64," in base64_str:
-        base64_str = base64_str.split("base64,")[1]
-    
-    image_bytes = base64.b64decode(base64_str)
-    return Image.open(io.BytesIO(image_bytes))
+def format_bytes(n):
+    """Human-friendly rendering of a byte count"""
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+def open_run(run_id):
+    """Show a past run as the current result, read back from the history"""
+    session_key = st.session_state.session_key
+    run = history.get(run_id, history_owner())
+    if run is None:
+        st.warning("That run is no longer in the history")
+        return
+    st.session_state.enhanced_image = images.put(session_key, history.load_blob(run["output_sha"]))
+    st.session_state.history_run = run_id
+    st.session_state.result_input = images.put(session_key, history.load_blob(run["input_sha"]))
+    st.session_state.processed = None
+    st.session_state.enhancement_prompt = run["prompt_used"]
+    st.session_state.before_after = []
+    st.session_state.upload_stats = None
+    st.session_state.timings = None
+    st.session_state.timestamp = datetime.fromtimestamp(run["created"]).strftime("%Y-%m-%d %H:%M:%S")
+    st.session_state.mode = "Single image"
+
+def history_owner():
+    """Whose runs this session may see: its own, or everyone's in a shared gallery"""
+    return None if HISTORY_SHARED else st.session_state.session_key
+
+def reset_history_page():
+    st.session_state.history_page = 0
+
+def format_upload(stats):
+    """One-line summary of what pre-flight preparation saved on the upload"""
+    if stats is None:
+        return "Served from cache, nothing uploaded"
+    summary = f"Uploaded {format_bytes(stats['sent_bytes'])}"
+    if stats["sent_bytes"] < stats["original_bytes"]:
+        saved = 100 * (1 - stats["sent_bytes"] / stats["original_bytes"])
+        summary += f" instead of {format_bytes(stats['original_bytes'])} ({saved:.0f}% smaller)"
+    if stats["sent_size"] != stats["original_size"]:
+        summary += " · downscaled {}×{} → {}×{}".format(*stats["original_size"], *stats["sent_size"])
+    if stats.get("tiles"):
+        summary += f" · {stats['tiles']} tiles"
+    return summary
+
+def show_performance(timings, renditions):
+    """Table of where the time of the last enhancement went"""
+    rows = ["| Phase | Time | Bytes |", "|---|---:|---:|"]
+    for phase in timings["phases"]:
+        label = phase["phase"] + (f" ×{phase['count']}" if phase["count"] > 1 else "")
+        size = format_bytes(phase["bytes"]) if phase["bytes"] is not None else ""
+        rows.append(f"| {label} | {phase['seconds'] * 1000:.0f} ms | {size} |")
+    for label, rendition in renditions:
+        rows.append(f"| render {label} | {rendition.seconds * 1000:.0f} ms | {format_bytes(len(rendition.data))} |")
+    rows.append(f"| **total** | **{timings['total'] * 1000:.0f} ms** | |")
+    st.markdown("\n".join(rows))
+
+def poll_interval(eta):
+    """Seconds until the next progress poll: every JOB_POLL_INTERVAL near the end, slower while far from it"""
+    if eta is None:
+        return JOB_POLL_INTERVAL
+    return min(max(eta / 10, JOB_POLL_INTERVAL), JOB_POLL_MAX_INTERVAL)
+
+def format_eta(seconds):
+    """Human-friendly rendering of an ETA in seconds"""
+    if seconds < 60:
+        return f"~{int(seconds)}s"
+    return f"~{int(seconds // 60)}m {int(seconds % 60)}s"
 
 # Header with space theme styling
 st.markdown("<h1 class='main-header'>🔭 Astronomy Image Enhancer</h1>", unsafe_allow_html=True)
@@ -308,84 +350,350 @@ if 'before_after' not in st.session_state:
     st.session_state.before_after = None
 if 'timestamp' not in st.session_state:
     st.session_state.timestamp = None
+if 'job_id' not in st.session_state:
+    st.session_state.job_id = None
+if 'upload_stats' not in st.session_state:
+    st.session_state.upload_stats = None
+if 'timings' not in st.session_state:
+    st.session_state.timings = None
+if 'batch' not in st.session_state:
+    st.session_state.batch = None
+if 'upload' not in st.session_state:
+    st.session_state.upload = None
+if 'processed' not in st.session_state:
+    st.session_state.processed = None
+if 'history_run' not in st.session_state:
+    # Id of the run reopened from the history, if that is the current result
+    st.session_state.history_run = None
+if 'result_input' not in st.session_state:
+    # The image the current result was made from, and the one the running job is using;
+    # comparisons pair the result with its own input, whatever is uploaded since
+    st.session_state.result_input = None
+    st.session_state.job_input = None
+if 'history_page' not in st.session_state:
+    st.session_state.history_page = 0
+if 'session_key' not in st.session_state:
+    # Owner of this session's share of the image memory budget and of its
+    # runs in the history; kept in the URL, so a reload or a bookmark brings
+    # the same history back (and sharing the link shares it)
+    session_key = st.query_params.get("session", "")
+    if not re.fullmatch(r"[0-9a-f]{32}", session_key):
+        session_key = uuid.uuid4().hex
+        st.query_params["session"] = session_key
+    st.session_state.session_key = session_key
+if 'renders' not in st.session_state:
+    # Encoded images shared by every widget, so each is encoded once per session
+    st.session_state.renders = RenderCache()
+renders = st.session_state.renders
 
 # Sidebar for inputs with space theme
 with st.sidebar:
     st.markdown("<h2 class='sub-header'>🚀 Enhancement Settings</h2>", unsafe_allow_html=True)
     
-    # Image upload
-    uploaded_file = st.file_uploader("Upload Image", type=["png", "jpg", "jpeg"])
-    
-    # Get models from API
-    models = get_models()
-    if not models:
-        models = [
-            "Stable Diffusion Upscaler (4x)",
-            "ESRGAN Plus (4x)",
-            "SwinIR (4x)",
-            "Codeformer (Face Enhancement)",
-            "Real-ESRGAN (4x)"
-        ]
-    
-    # Model selection
-    model_name = st.selectbox(
-        "Upscaler Model",
-        models
-    )
-    
-    # Get presets from API
-    presets = get_presets()
-    if not presets:
-        presets = [
-            "General Astronomy",
-            "Galaxy",
-            "Nebula",
-            "Planet",
-            "Star Cluster", 
-            "Solar Surface",
-            "Black Hole",
-            "Deep Field",
-            "Scientific Accuracy"
-        ]
-    
-    # Preset selection
-    preset = st.selectbox(
-        "Preset Enhancement Type",
-        presets
-    )
-    
-    # Custom prompt
-    custom_prompt = st.text_area("Custom Enhancement Description (optional)")
-    if custom_prompt == "":
-        custom_prompt = None
-    
-    # Noise level
-    noise_level = st.slider("Noise Level", min_value=0.0, max_value=50.0, value=20.0, 
-                          help="Higher = more creative, lower = more faithful")
+    # Single image, a whole batch or past runs
+    mode = st.radio("Mode", ["Single image", "Batch", "History"], horizontal=True, key="mode")
+    batch_mode = mode == "Batch"
     
-    # Scientific mode
-    scientific_mode = st.checkbox("Scientific Accuracy Mode", 
-                               help="Prevents artificial additions")
+    # Image upload
+    if mode == "History":
+        uploaded_file = uploaded_files = None
+    elif batch_mode:
+        uploaded_file = None
+        uploaded_files = st.file_uploader("Upload Images", type=["png", "jpg", "jpeg"],
+                                          accept_multiple_files=True)
+    else:
+        uploaded_file = st.file_uploader("Upload Image", type=["png", "jpg", "jpeg"])
+    
+    # Settings are edited together and only take effect on submit, so tweaking
+    # a slider does not rerun the page until the user applies or enhances
+    with st.form("enhancement_settings", border=False):
+        # Get models from API
+        models = get_models()
+        if not models:
+            models = [
+                "Stable Diffusion Upscaler (4x)",
+                "ESRGAN Plus (4x)",
+                "SwinIR (4x)",
+                "Codeformer (Face Enhancement)",
+                "Real-ESRGAN (4x)"
+            ]
+    
+        # Model selection
+        model_name = st.selectbox(
+            "Upscaler Model",
+            models
+        )
+    
+        # Get presets from API
+        presets = get_presets()
+        if not presets:
+            presets = [
+                "General Astronomy",
+                "Galaxy",
+                "Nebula",
+                "Planet",
+                "Star Cluster", 
+                "Solar Surface",
+                "Black Hole",
+                "Deep Field",
+                "Scientific Accuracy"
+            ]
+    
+        # Preset selection
+        preset = st.selectbox(
+            "Preset Enhancement Type",
+            presets
+        )
+    
+        # Custom prompt
+        custom_prompt = st.text_area("Custom Enhancement Description (optional)")
+        if custom_prompt == "":
+            custom_prompt = None
+    
+        # Noise level
+        noise_level = st.slider("Noise Level", min_value=0.0, max_value=50.0, value=20.0, 
+                              help="Higher = more creative, lower = more faithful")
+    
+        # Scientific mode
+        scientific_mode = st.checkbox("Scientific Accuracy Mode", 
+                                   help="Prevents artificial additions")
+    
+        # Cheap corrections run on this server instead of the GPU backend
+        with st.expander("🧪 Local processing"):
+            st.caption("Before upload")
+            subtract_background = st.checkbox("Subtract background",
+                                              help="Remove sky glow and gradients")
+            stretch = st.selectbox("Stretch", ["None", "asinh", "log"],
+                                   help="Lift faint detail before the upscaler sees it")
+            stretch_strength = st.slider("Stretch strength", min_value=1.0, max_value=100.0, value=10.0,
+                                         help="Only used with a stretch")
+            st.caption("On the result (applied without a new run)")
+            denoise = st.slider("Denoise", min_value=0.0, max_value=1.0, value=0.0)
+            protect_stars = st.checkbox("Protect stars", value=True, help="Leave point sources unsmoothed")
+    
+        # Upload preparation
+        tiled = st.checkbox("Tiled mode for large images",
+                            help="Enhance the full-size image in overlapping tiles and "
+                                 "blend them back together")
+        downscale = st.checkbox("Downscale large uploads", value=True,
+                                help="Shrink images beyond what the selected model can use "
+                                     "before uploading, stripping their metadata; images that already "
+                                     "fit are sent untouched (not in tiled mode)")
+    
+        # Result caching
+        cacheable = st.checkbox("Reuse results for identical settings", value=True,
+                                help="Turn off to draw a fresh sample from the upscaler "
+                                     "(noise makes repeated runs differ)")
+    
+        # Batch dispatch settings
+        if batch_mode:
+            batch_concurrency = st.slider("Parallel requests", min_value=1, max_value=8,
+                                          value=BATCH_CONCURRENCY)
+    
+        # Apply updates the local previews; Enhance also sends the image
+        st.form_submit_button("Apply settings", use_container_width=True)
+        if batch_mode:
+            process_button = st.form_submit_button(f"✨ Enhance {len(uploaded_files)} Images",
+                                                   use_container_width=True, type="primary",
+                                                   disabled=not uploaded_files)
+        else:
+            process_button = st.form_submit_button("✨ Enhance Image", use_container_width=True,
+                                                   type="primary")
+    preprocess = Processing(None if stretch == "None" else stretch, stretch_strength, subtract_background)
+    postprocess = Processing(denoise=denoise, protect_stars=protect_stars)
+
+    # How busy the shared queue is, and how long a run submitted now would wait in it (batches do
+    # not go through the job queue: they start at once and their items wait for backend slots)
+    queue = jobs.queue_stats()
+    queued = sum(queue["queued"].values())
+    if queued or queue["running"]:
+        line = f"📋 {queued} queued from {queue['sessions']} sessions, {queue['running']} running"
+        if not batch_mode:
+            priority = jobs.priority_for(model_name)
+            wait = jobs.expected_wait(st.session_state.session_key, model_name, priority)
+            line += f" · a new {PRIORITY_NAMES[priority]} run would wait {format_eta(wait)}"
+        st.caption(line)
+    
+    # Backend health, as seen by the pool's background checks
+    with st.expander("🛰️ Backends"):
+        for backend in pool.backends:
+            status = "🟢" if backend.healthy else "🔴"
+            latency = f"{backend.latency * 1000:.0f} ms" if backend.latency is not None else "n/a"
+            st.caption(f"{status} {backend.url} · {latency} · {backend.in_flight} in flight")
+        runs, waiting = inflight.in_flight()
+        if waiting:
+            st.caption(f"🔗 {waiting} identical requests sharing {runs} running enhancements")
+
+# Batch mode has its own page body
+if batch_mode:
+    st.markdown("<h2 class='sub-header'>Batch Enhancement</h2>", unsafe_allow_html=True)
+    batch = st.session_state.batch
+    
+    if process_button and (batch is None or batch.finished):
+        items = [BatchItem(f.name, f.getvalue) for f in uploaded_files]
+        settings = dict(model_name=model_name, preset=preset, custom_prompt=custom_prompt,
+                        noise_level=noise_level, scientific_mode=scientific_mode,
+                        cacheable=cacheable, downscale=downscale, tiled=tiled,
+                        preprocess=preprocess, postprocess=postprocess)
+        if batch is not None:
+            # Only the latest archive of a session can still be downloaded
+            batch.sink.discard()
+        batch = zip_batch(items, batch_concurrency, **settings)
+        st.session_state.batch = batch
+        batch.start(owner=st.session_state.session_key)
+    
+    if batch is None:
+        st.info("Upload images in the sidebar to enhance them in one go")
+    else:
+        counts = batch.counts()
+        st.progress(batch.progress(), text=f"{counts['done']} done, {counts['failed']} failed, "
+                                           f"{counts['running']} running, {counts['queued']} queued")
+        for item in batch.items:
+            icon = {"queued": "⏳", "running": "✨", "done": "✅", "failed": "❌"}[item.status]
+            line = f"{icon} {item.name}"
+            if item.duration is not None:
+                line += f" · {item.duration:.1f}s"
+            if item.error is not None:
+                line += f" · {item.error}"
+            st.text(line)
+        
+        if batch.finished and counts["done"] and os.path.exists(batch.sink.path):
+            with open(batch.sink.path, "rb") as archive:
+                st.download_button(
+                    label="📥 Download Enhanced Images (ZIP)",
+                    data=archive,
+                    file_name=f"enhanced_images_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip",
+                    mime="application/zip",
+                    use_container_width=True
+                )
+        elif batch.finished and counts["done"]:
+            st.info("This batch's archive has expired; enhance the images again to download them")
+    
+    st.markdown("<div class='footer'>✨ Powered by AI Image Enhancement Technology ✨</div>", unsafe_allow_html=True)
+    
+    # Poll the running batch until every item has finished
+    if batch is not None and not batch.finished:
+        time.sleep(poll_interval(batch.eta()))
+        st.rerun()
+    st.stop()
+
+# Past runs, newest first, a page at a time
+if mode == "History":
+    st.markdown("<h2 class='sub-header'>Enhancement History</h2>", unsafe_allow_html=True)
+    
+    owner = history_owner()
+    filters = st.columns([1, 2])
+    with filters[0]:
+        history_model = st.selectbox("Model", ["All models"] + history.models(owner), on_change=reset_history_page)
+    with filters[1]:
+        history_search = st.text_input("Search file names and prompts", on_change=reset_history_page)
+    history_model = None if history_model == "All models" else history_model
+    
+    total = history.count(owner, history_model, history_search)
+    pages = max(1, -(-total // HISTORY_PAGE_SIZE))
+    page = min(st.session_state.history_page, pages - 1)
+    runs = history.page(page * HISTORY_PAGE_SIZE, HISTORY_PAGE_SIZE, owner, history_model, history_search)
+    
+    if not runs:
+        st.info("Enhanced images will be listed here" if HISTORY_SHARED else
+                "Images you enhance will be listed here; bookmark this page's link to come back to them")
+    # Thumbnails were made when each run was recorded; nothing full-size is read here
+    columns = st.columns(4)
+    for i, run in enumerate(runs):
+        with columns[i % 4]:
+            thumb = history.thumb_path(run["output_sha"])
+            if os.path.exists(thumb):
+                # Gone if the run was deleted to keep the history within its size limit
+                st.image(thumb, use_column_width=True)
+            created = datetime.fromtimestamp(run["created"]).strftime("%Y-%m-%d %H:%M")
+            st.caption(f"{run['filename']} · {run['model']} · {run['preset']} · {created}")
+            st.button("Open", key=f"open_run_{run['id']}", on_click=open_run, args=(run["id"],),
+                      use_container_width=True)
+    
+    if pages > 1:
+        nav = st.columns([1, 2, 1])
+        with nav[0]:
+            if st.button("← Newer", disabled=page == 0, use_container_width=True):
+                st.session_state.history_page = page - 1
+                st.rerun()
+        with nav[1]:
+            st.markdown(f"<p style='text-align: center;'>Page {page + 1} of {pages} · {total} runs</p>",
+                        unsafe_allow_html=True)
+        with nav[2]:
+            if st.button("Older →", disabled=page == pages - 1, use_container_width=True):
+                st.session_state.history_page = page + 1
+                st.rerun()
     
-    # Process button
-    process_button = st.button("✨ Enhance Image", use_container_width=True)
+    st.markdown("<div class='footer'>✨ Powered by AI Image Enhancement Technology ✨</div>", unsafe_allow_html=True)
+    st.stop()
+
+# Pick up the result of a background enhancement job, if one has finished
+job = jobs.get(st.session_state.job_id) if st.session_state.job_id else None
+if st.session_state.job_id and job is None:
+    # The job expired or the server restarted
+    st.session_state.job_id = None
+elif job is not None and job.finished:
+    st.session_state.job_id = None
+    # Take the job off the manager, so its result is held only by this session
+    job = jobs.collect(job.id)
+    if job is not None and job.error is not None:
+        show_enhance_error(job.error)
+    elif job is not None:
+        try:
+            result = job.result
+            
+            # Store the encoded results in session state; they are only
+            # decoded or re-encoded if a widget needs another format, and may
+            # be spilled to disk when the session is over its memory budget
+            session_key = st.session_state.session_key
+            st.session_state.enhanced_image = images.put(session_key, result["enhanced_image"])
+            st.session_state.processed = None
+            st.session_state.history_run = None
+            st.session_state.result_input = st.session_state.job_input
+            st.session_state.enhancement_prompt = result["prompt_used"]
+            st.session_state.before_after = [images.put(session_key, img) for img in result["before_after"]]
+            st.session_state.upload_stats = result["upload"]
+            st.session_state.timings = result["timings"]
+            st.session_state.timestamp = datetime.fromtimestamp(job.finished_at).strftime("%Y-%m-%d %H:%M:%S")
+        except Exception as e:
+            st.error(f"Error enhancing image: {str(e)}")
+    job = None
+
+# The result as shown and downloaded: the backend's output after any local
+# corrections, which are redone only when the result or the settings change
+enhanced_image = st.session_state.enhanced_image
+if enhanced_image is not None and postprocess:
+    processed_key = (enhanced_image.key, postprocess.key())
+    if st.session_state.processed is None or st.session_state.processed[0] != processed_key:
+        processed = images.put(st.session_state.session_key, postprocess.apply(enhanced_image.data))
+        st.session_state.processed = (processed_key, processed)
+    enhanced_image = st.session_state.processed[1]
+
+# The upload as a stored image, hashed once per file rather than on every rerun
+original_image = None
+if uploaded_file is not None:
+    if st.session_state.upload is None or st.session_state.upload[0] != uploaded_file.file_id:
+        st.session_state.upload = (uploaded_file.file_id,
+                                   images.put(st.session_state.session_key, uploaded_file.getvalue()))
+    original_image = st.session_state.upload[1]
+else:
+    st.session_state.upload = None
+    # With nothing uploaded (e.g. a run reopened from the history), show what the result was made from
+    original_image = st.session_state.result_input
 
 # Main content
 col1, col2 = st.columns([1, 1])
 
 with col1:
     st.markdown("<h2 class='sub-header'>Original Image</h2>", unsafe_allow_html=True)
-    if uploaded_file is not None:
-        image = Image.open(uploaded_file)
-        # Save the image to a bytes buffer and convert to base64 for HTML display
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+    if original_image is not None:
+        # Column-width preview; the full-resolution upload never goes to the browser
+        original = renders.preview(original_image)
         
         # Display the image with an ID using HTML
         st.markdown(f'''
         <div style="width:100%;">
-            <img src="data:image/png;base64,{img_str}" id="original-image" 
+            <img src="{original.data_url}" id="original-image" 
                 style="width:100%; border-radius:10px; box-shadow: 0 4px 8px rgba(0,0,0,0.3);">
         </div>
         ''', unsafe_allow_html=True)
@@ -394,16 +702,26 @@ with col1:
 
 with col2:
     st.markdown("<h2 class='sub-header'>Enhanced Result</h2>", unsafe_allow_html=True)
-    if st.session_state.enhanced_image is not None:
-        # Save the enhanced image to a bytes buffer and convert to base64 for HTML display
-        buffered = io.BytesIO()
-        st.session_state.enhanced_image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+    if job is not None:
+        # Show progress of the running job; the page polls until it finishes
+        position = jobs.queue_position(job.id)
+        eta = format_eta(jobs.eta(job.id))
+        if position:
+            status = f"⏳ Queued (position {position}, {PRIORITY_NAMES[job.priority]}), ETA {eta}"
+        elif job.uploading:
+            sent, total = job.upload_progress
+            status = f"⬆️ Uploading {format_bytes(sent)} of {format_bytes(total)}, ETA {eta}"
+        else:
+            status = f"✨ Enhancing your image... ETA {eta}"
+        st.progress(job.progress(), text=status)
+    if enhanced_image is not None and job is None:
+        # Column-width preview; full resolution is only served by the download button
+        enhanced = renders.preview(enhanced_image)
         
         # Display the image with an ID using HTML
         st.markdown(f'''
         <div style="width:100%;">
-            <img src="data:image/png;base64,{img_str}" id="enhanced-image" 
+            <img src="{enhanced.data_url}" id="enhanced-image" 
                 style="width:100%; border-radius:10px; box-shadow: 0 4px 8px rgba(0,0,0,0.3);">
         </div>
         ''', unsafe_allow_html=True)
@@ -411,164 +729,119 @@ with col2:
         # Display timestamp
         if st.session_state.timestamp:
             st.caption(f"Enhanced on: {st.session_state.timestamp}")
+            if st.session_state.history_run is not None:
+                st.caption(f"Reopened from history (run {st.session_state.history_run})")
+            else:
+                st.caption(format_upload(st.session_state.upload_stats))
+        
+        # Where the time went, for diagnosing slow enhancements
+        if st.session_state.timings:
+            with st.expander("⏱️ Performance breakdown"):
+                renditions = [("enhanced preview", enhanced)]
+                if original_image is not None:
+                    renditions.insert(0, ("original preview", original))
+                show_performance(st.session_state.timings, renditions)
             
         # Display prompt used
         if st.session_state.enhancement_prompt:
             with st.expander("Enhancement Prompt Used"):
                 st.write(st.session_state.enhancement_prompt)
+    elif uploaded_file is not None:
+        # Instant classical preview for the current settings, replaced by the AI result when it arrives
+        quick = renders.quick_preview(original_image, model_name, noise_level, scientific_mode,
+                                      preprocess)
+        st.markdown(f'''
+        <div style="width:100%;">
+            <img src="{quick.data_url}" id="enhanced-image" 
+                style="width:100%; border-radius:10px; box-shadow: 0 4px 8px rgba(0,0,0,0.3);">
+        </div>
+        ''', unsafe_allow_html=True)
+        st.caption(f"⚡ Instant local preview (Lanczos + sharpening, {quick.seconds * 1000:.0f} ms); "
+                   "the AI-enhanced result replaces it when ready")
     else:
         st.info("Enhanced image will appear here")
 
-# Process the image when button is clicked
-if uploaded_file is not None and process_button:
-    with st.spinner("✨ Enhancing your image... Please wait, this may take a minute."):
-        try:
-            # Reset the file pointer to the beginning
-            uploaded_file.seek(0)
-            
-            # Send to API for enhancement
-            result = enhance_image(
-                uploaded_file,
-                model_name,
-                preset,
-                custom_prompt,
-                noise_level,
-                scientific_mode
-            )
-            
-            if result:
-                # Extract data from API response
-                enhanced_image_base64 = result["enhanced_image"]
-                enhancement_prompt = result["prompt_used"]
-                before_after_base64 = result["before_after"]
-                
-                # Convert base64 to images
-                enhanced_image = base64_to_image(enhanced_image_base64)
-                before_after_images = [base64_to_image(img) for img in before_after_base64]
-                
-                # Store results in session state
-                st.session_state.enhanced_image = enhanced_image
-                st.session_state.enhancement_prompt = enhancement_prompt
-                st.session_state.before_after = before_after_images
-                st.session_state.timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                
-                # Trigger rerun to update the UI
-                st.rerun()
-            
-        except Exception as e:
-            st.error(f"Error enhancing image: {str(e)}")
-
-# Magnifying glass comparison (only if we have results)
-if st.session_state.enhanced_image is not None and uploaded_file is not None:
-    st.markdown("<h2 class='sub-header'>🔍 Magnifying Glass Comparison</h2>", unsafe_allow_html=True)
-    st.markdown("<p>Hover over the original image to see a detailed comparison with the enhanced version</p>", unsafe_allow_html=True)
+# Submit the image for enhancement when button is clicked
+if uploaded_file is not None and process_button and job is None:
+    # Hand the worker its own copy of the upload, so it outlives this rerun
+    image_file = io.BytesIO(uploaded_file.getvalue())
+    st.session_state.job_input = original_image
+    st.session_state.job_id = jobs.submit(
+        enhance_and_record,
+        image_file,
+        uploaded_file.name,
+        model_name,
+        preset,
+        custom_prompt,
+        noise_level,
+        scientific_mode,
+        cacheable=cacheable,
+        downscale=downscale,
+        tiled=tiled,
+        preprocess=preprocess,
+        label=model_name,
+        owner=st.session_state.session_key
+    )
     
-    # Create two columns for the comparison
-    comp_cols = st.columns([1, 1])
-    with comp_cols[0]:
-        # Create a container for the original image with hover functionality
-        st.markdown('<div class="comparison-container">', unsafe_allow_html=True)
-        
-        # Use the session state to get the original image and convert to base64
-        image = Image.open(uploaded_file)
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        
-        # Display the image with HTML
-        st.markdown(f'''
-        <img src="data:image/png;base64,{img_str}" id="magnify-original" 
-            style="width:100%; border-radius:10px; box-shadow: 0 4px 8px rgba(0,0,0,0.3);">
-        ''', unsafe_allow_html=True)
+    # Trigger rerun to show the job's progress
+    st.rerun()
+
+# While a job runs the page only polls its progress. Streamlit 1.32 has no
+# fragments, so each poll still reruns the script from the top; the previous
+# result's comparisons and download are left out of those reruns, and polls
+# are spaced further apart while the job has long to go
+if job is not None:
+    st.markdown("<div class='footer'>✨ Powered by AI Image Enhancement Technology ✨</div>", unsafe_allow_html=True)
+    time.sleep(poll_interval(jobs.eta(job.id)))
+    st.rerun()
+
+# Magnifying glass comparison (only if we have results), built only when opened
+result_input = st.session_state.result_input
+if enhanced_image is not None and result_input is not None:
+    if st.toggle("🔍 Magnifying Glass Comparison", key="show_magnifier"):
+        st.markdown("<h2 class='sub-header'>🔍 Magnifying Glass Comparison</h2>", unsafe_allow_html=True)
+        st.markdown("<p>Hover over the original image to see the enhanced version under the glass; scroll to zoom</p>", unsafe_allow_html=True)
+        zoom = st.slider("Zoom", min_value=1.0, max_value=16.0, value=MAGNIFIER_ZOOM, step=0.5)
         
-        st.markdown('</div>', unsafe_allow_html=True)
+        # The result's own input (usually the rendition already built for the
+        # "Original Image" column); the enhanced side is cut into tiles once per result
+        original = renders.preview(result_input)
+        pyramid = pyramids.get(enhanced_image)
+        components.html(magnifier_html(original.data_url, pyramid, zoom), height=MAGNIFIER_HEIGHT + 10)
         st.caption("Original Image - Hover to compare")
-    
-    with comp_cols[1]:
-        # Display the enhanced image (used by the magnifier) using HTML
-        buffered = io.BytesIO()
-        st.session_state.enhanced_image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+
+# Before vs After comparison (only if we have results), built only when opened
+if enhanced_image is not None:
+    if st.toggle("Before vs After Comparison", key="show_before_after"):
+        st.markdown("<h2 class='sub-header'>Before vs After Comparison</h2>", unsafe_allow_html=True)
         
-        st.markdown(f'''
-        <img src="data:image/png;base64,{img_str}" id="magnify-enhanced" 
-            style="width:100%; border-radius:10px; box-shadow: 0 4px 8px rgba(0,0,0,0.3);">
-        ''', unsafe_allow_html=True)
-        st.caption("Enhanced Image")
-    
-    # JavaScript to activate the magnifying glass
-    st.markdown("""
-    <script>
-        // Wait for the DOM to be fully loaded
-        setTimeout(function() {
-            // Initialize magnify function
-            var origImg = document.getElementById('magnify-original');
-            var enhancedImg = document.getElementById('magnify-enhanced');
-            
-            if (origImg && enhancedImg) {
-                magnify("magnify-original", "magnify-enhanced", 1);
-            }
-        }, 2000);  // Added delay to ensure elements are loaded
-    </script>
-    """, unsafe_allow_html=True)
-
-# Before vs After comparison (only if we have results)
-if st.session_state.before_after is not None:
-    st.markdown("<h2 class='sub-header'>Before vs After Comparison</h2>", unsafe_allow_html=True)
-    
-    # Extract images from the before_after list
-    if len(st.session_state.before_after) >= 2:
-        cols = st.columns(2)
-        with cols[0]:
-            st.image(st.session_state.before_after[0], caption="Original", use_column_width=True)
-        with cols[1]:
-            st.image(st.session_state.before_after[1], caption="Enhanced", use_column_width=True)
+        # Older backends still send the pair; otherwise it is the result's input and the result
+        if st.session_state.before_after and len(st.session_state.before_after) >= 2:
+            before, after = (img.data for img in st.session_state.before_after[:2])
+        elif result_input is not None:
+            before = renders.preview(result_input).data
+            after = renders.preview(enhanced_image).data
+        else:
+            before = after = None
+            st.info("Upload the original image again to compare it with the result")
+        if before is not None:
+            cols = st.columns(2)
+            with cols[0]:
+                st.image(before, caption="Original", use_column_width=True)
+            with cols[1]:
+                st.image(after, caption="Enhanced", use_column_width=True)
 
 # Add download button if enhanced image exists
-if st.session_state.enhanced_image is not None:
-    buffered = io.BytesIO()
-    st.session_state.enhanced_image.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
+if enhanced_image is not None:
+    download = renders.encoded(enhanced_image, "PNG")
     
     st.download_button(
         label="📥 Download Enhanced Image",
-        data=buffered.getvalue(),
+        data=download.data,
         file_name=f"enhanced_image_{st.session_state.timestamp.replace(' ', '_').replace(':', '-')}.png",
         mime="image/png",
         use_container_width=True
     )
 
-# Add an HTML component to ensure the JavaScript for magnifying glass is properly loaded
-st.components.v1.html("""
-<script>
-// This is a trigger to make sure our JavaScript runs after all images are loaded
-document.addEventListener('DOMContentLoaded', function() {
-    console.log('DOM fully loaded');
-});
-
-// Additional event listener for images
-window.addEventListener('load', function() {
-    console.log('All resources loaded');
-    
-    // Try to initialize magnifier after a delay
-    setTimeout(function() {
-        try {
-            var origImg = document.getElementById('original-image');
-            var enhancedImg = document.getElementById('enhanced-image');
-            
-            if (origImg && enhancedImg) {
-                console.log('Images found, initializing magnifier');
-                magnify("original-image", "enhanced-image", 1);
-            } else {
-                console.log('Images not found yet');
-            }
-        } catch (e) {
-            console.error('Error initializing magnifier:', e);
-        }
-    }, 3000);
-});
-</script>
-""", height=0)
-
 # Footer with space theme
 st.markdown("<div class='footer'>✨ Powered by AI Image Enhancement Technology ✨</div>", unsafe_allow_html=True)
\ No newline at end of file
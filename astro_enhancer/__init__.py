@@ -0,0 +1,11 @@
+"""Client-side helpers for the Astronomy Image Enhancer backend
+
+    >>> import astro_enhancer
+    >>> astro_enhancer.list_models()
+    >>> astro_enhancer.enhance("m31.jpg", preset="Galaxy", output="m31_enhanced.png")
+    >>> astro_enhancer.enhance("m31.jpg", preprocess=astro_enhancer.Processing(stretch="asinh"))
+"""
+from .api import enhance, list_models, list_presets
+from .processing import Processing
+
+__all__ = ["Processing", "enhance", "list_models", "list_presets"]
@@ -0,0 +1,49 @@
+"""Python API for scripts and pipelines, with no Streamlit involved"""
+import io
+import os
+
+from . import config
+from .backends import pool
+from .catalog import catalog
+from .pipeline import enhance as _enhance
+
+
+def list_models(base_url=None):
+    """Names of the upscaler models the backend (or any healthy backend in the pool) offers"""
+    if base_url is None:
+        return pool.models()
+    return catalog.get(f"{base_url}/models")
+
+
+def list_presets(base_url=None):
+    """Names of the enhancement presets the backend offers"""
+    return catalog.get(f"{base_url or pool.primary_url()}/presets")
+
+
+def enhance(image, model_name=config.DEFAULT_MODEL, preset=config.DEFAULT_PRESET, custom_prompt=None,
+            noise_level=20.0, scientific_mode=False, output=None, filename=None, cacheable=True,
+            downscale=True, tiled=False, base_url=None, preprocess=None, postprocess=None):
+    """Enhance one image and return the result dict
+
+    image may be a path, raw bytes or a binary file object. When output is
+    given, the enhanced image is also written there. Without base_url, the
+    request goes to the best healthy backend in the pool. preprocess and
+    postprocess take a Processing to run locally before upload and after
+    download.
+    """
+    if isinstance(image, (str, os.PathLike)):
+        filename = filename or os.path.basename(image)
+        with open(image, "rb") as f:
+            image_file = io.BytesIO(f.read())
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        image_file = io.BytesIO(image)
+    else:
+        image_file = image
+    filename = filename or getattr(image_file, "name", None) or "image.png"
+
+    result = _enhance(image_file, os.path.basename(filename), model_name, preset, custom_prompt, noise_level,
+                      scientific_mode, cacheable, downscale, tiled, base_url, preprocess, postprocess)
+    if output is not None:
+        with open(output, "wb") as f:
+            f.write(result["enhanced_image"])
+    return result
@@ -0,0 +1,187 @@
+"""Pool of enhancement backends with health checks and failover
+
+Tunnels come and go, so the client knows about several backends (see
+config.BACKEND_URLS). Each one is probed through /models, which yields both
+its round-trip latency and the models it serves. Requests go to the fastest
+healthy, least loaded backend that serves the requested model, and move on
+to the next one when a backend fails.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from . import client, config, metrics
+
+# Weight of the newest sample in the moving average of a backend's latency
+LATENCY_SMOOTHING = 0.3
+
+
+class NoBackendAvailable(Exception):
+    """No healthy backend serves the requested model"""
+
+
+class Backend:
+    """Health and load of one backend URL"""
+
+    def __init__(self, url):
+        self.url = url
+        self.healthy = None
+        self.latency = None
+        self.models = None
+        self.etag = None
+        self.in_flight = 0
+        self.failures = 0
+        self.checked_at = None
+        self.error = None
+
+    def serves(self, model_name):
+        return model_name is None or self.models is None or model_name in self.models
+
+    def score(self):
+        """Lower is better: latency, inflated by the requests already queued on it"""
+        return (self.latency or 1.0) * (1 + self.in_flight)
+
+    def mark_failed(self, error):
+        self.healthy = False
+        self.failures += 1
+        self.error = error
+        self.checked_at = time.monotonic()
+
+    def record_latency(self, seconds):
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += LATENCY_SMOOTHING * (seconds - self.latency)
+
+
+class BackendPool:
+    """Latency-aware load balancing and failover across backends"""
+
+    def __init__(self, urls=config.BACKEND_URLS, interval=config.HEALTH_CHECK_INTERVAL,
+                 cooldown=config.UNHEALTHY_COOLDOWN):
+        self.backends = [Backend(url) for url in urls]
+        self.interval = interval
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._checked = threading.Event()
+        self._monitor = None
+
+    def check(self, backend):
+        """Probe one backend through /models"""
+        start = time.perf_counter()
+        try:
+            # No retries: a slow or flaky backend should simply score badly
+            models, backend.etag = client.get_json(f"{backend.url}/models", backend.etag, retries=0)
+        except Exception as e:
+            backend.mark_failed(e)
+            metrics.registry.set("backend_up", 0, backend=backend.url)
+            return
+        backend.record_latency(time.perf_counter() - start)
+        if models is not None:
+            backend.models = models
+        backend.healthy = True
+        backend.failures = 0
+        backend.error = None
+        backend.checked_at = time.monotonic()
+        metrics.registry.set("backend_up", 1, backend=backend.url)
+        metrics.registry.set("backend_latency_seconds", backend.latency, backend=backend.url)
+
+    def check_all(self):
+        """Probe every backend concurrently"""
+        with ThreadPoolExecutor(max_workers=max(len(self.backends), 1), thread_name_prefix="health") as pool:
+            list(pool.map(self.check, self.backends))
+        self._checked.set()
+
+    def _run_monitor(self):
+        while True:
+            self.check_all()
+            time.sleep(self.interval)
+
+    def start(self):
+        """Run health checks in the background, waiting for the first round"""
+        with self._lock:
+            if self._monitor is None:
+                self._monitor = threading.Thread(target=self._run_monitor, name="backend-health", daemon=True)
+                self._monitor.start()
+        self._checked.wait()
+        return self
+
+    def candidates(self, model_name=None):
+        """Backends worth trying for model_name, best first"""
+        self.start()
+        now = time.monotonic()
+        with self._lock:
+            usable = [
+                b for b in self.backends
+                if b.serves(model_name) and (b.healthy or now - (b.checked_at or 0) >= self.cooldown)
+            ]
+            # Healthy ones first, then those whose cooldown has run out
+            return sorted(usable, key=lambda b: (not b.healthy, b.score()))
+
+    def primary_url(self):
+        """URL of the best backend right now (for catalog requests)"""
+        candidates = self.candidates()
+        return candidates[0].url if candidates else self.backends[0].url
+
+    def models(self):
+        """Union of the models served by healthy backends, in first-seen order"""
+        self.start()
+        seen = {}
+        for backend in sorted(self.backends, key=lambda b: b.score()):
+            if backend.healthy and backend.models:
+                seen.update(dict.fromkeys(backend.models))
+        if not seen:
+            errors = [b.error for b in self.backends if b.error is not None]
+            raise errors[0] if errors else NoBackendAvailable("No enhancement backend is reachable")
+        return list(seen)
+
+    def call(self, model_name, fn):
+        """Call fn(base_url, retries) on the best backend for model_name, failing over on errors
+
+        Only the last candidate gets the usual retries; before that, moving
+        on to the next backend beats backing off on a failing one.
+        """
+        last_error = None
+        # When no backend lists the model, let one of them answer for it
+        candidates = self.candidates(model_name) or self.candidates()
+        for i, backend in enumerate(candidates):
+            with self._lock:
+                backend.in_flight += 1
+            try:
+                return fn(backend.url, None if i == len(candidates) - 1 else 0)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = e
+            except client.APIError as e:
+                # 4xx means the request itself is wrong; another backend won't help
+                if e.status_code < 500 and e.status_code != 429:
+                    raise
+                last_error = e
+            finally:
+                with self._lock:
+                    backend.in_flight -= 1
+            backend.mark_failed(last_error)
+            metrics.registry.inc("backend_failovers_total", backend=backend.url)
+            metrics.registry.set("backend_up", 0, backend=backend.url)
+        if last_error is not None:
+            raise last_error
+        raise NoBackendAvailable(f"No reachable backend serves {model_name}")
+
+
+def enhance_image(image_file, filename, mime_type, data, base_url=None, progress=None):
+    """client.enhance_image against base_url, or the pool when base_url is None"""
+    if base_url is not None:
+        return client.enhance_image(base_url, image_file, filename, mime_type, data, progress=progress)
+    start = image_file.tell()
+
+    def attempt(url, retries):
+        image_file.seek(start)
+        return client.enhance_image(url, image_file, filename, mime_type, data, retries=retries,
+                                    progress=progress)
+
+    return pool.call(data.get("model_name"), attempt)
+
+
+# Shared by every Streamlit session in this process
+pool = BackendPool()
@@ -0,0 +1,216 @@
+"""Batch enhancement of many images with parallel dispatch
+
+Inputs are loaded only when their turn comes, and each result is written to
+the output (a ZIP archive or a folder) as soon as it arrives, so memory holds
+no more than `concurrency` images at a time.
+"""
+import io
+import os
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from . import config, scheduler
+from .pipeline import enhance
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def image_extension(data):
+    """File extension matching the encoded image's signature"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return ".png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    if data[:2] == b"\xff\xd8":
+        return ".jpg"
+    return ".bin"
+
+
+def output_name(filename, data):
+    stem = filename.rsplit(".", 1)[0] if "." in filename else filename
+    return f"{stem}_enhanced{image_extension(data)}"
+
+
+class BatchItem:
+    """One input of a batch; load() returns its bytes when it is dispatched"""
+
+    def __init__(self, name, load):
+        self.name = name
+        self.load = load
+        self.status = QUEUED
+        self.error = None
+        self.output = None
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def duration(self):
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+
+class ZipSink:
+    """Appends results to a ZIP archive on disk as they finish"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        # Images are already compressed; deflating them again only costs CPU
+        self._zip = zipfile.ZipFile(path, "w", zipfile.ZIP_STORED)
+        self._lock = threading.Lock()
+        self._names = set()
+
+    def write(self, name, data):
+        with self._lock:
+            name = os.path.basename(name)
+            stem, ext = os.path.splitext(name)
+            unique, n = name, 1
+            while unique in self._names:
+                unique, n = f"{stem}_{n}{ext}", n + 1
+            self._names.add(unique)
+            self._zip.writestr(unique, data)
+            return unique
+
+    def close(self):
+        with self._lock:
+            self._zip.close()
+
+    def discard(self):
+        """Close and delete the archive"""
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class FolderSink:
+    """Writes results into a directory as they finish"""
+
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+
+    def write(self, name, data):
+        # Never let a name step outside the output directory
+        path = os.path.join(self.path, os.path.basename(name))
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def close(self):
+        pass
+
+
+class Batch:
+    """A set of images enhanced with the same settings"""
+
+    def __init__(self, items, sink, concurrency=config.BATCH_CONCURRENCY, **settings):
+        self.id = uuid.uuid4().hex
+        self.items = items
+        self.sink = sink
+        self.concurrency = concurrency
+        self.settings = settings
+        self.started_at = None
+        self.finished = False
+
+    def counts(self):
+        """Number of items in each status"""
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        for item in self.items:
+            counts[item.status] += 1
+        return counts
+
+    def progress(self):
+        done = sum(item.status in (DONE, FAILED) for item in self.items)
+        return done / len(self.items) if self.items else 1.0
+
+    def eta(self, now=None):
+        """Seconds until the last item finishes, extrapolated from progress so far; None until one has"""
+        done = self.progress()
+        if self.started_at is None or not done:
+            return None
+        elapsed = (now or time.time()) - self.started_at
+        return elapsed * (1 - done) / done
+
+    def _process(self, item, identity):
+        item.status = RUNNING
+        item.started_at = time.time()
+        try:
+            data = item.load()
+            # Items are scheduled as the batch's owner's bulk work
+            with scheduler.acting_as(*identity):
+                result = enhance(io.BytesIO(data), item.name, **self.settings)
+            del data
+            item.output = self.sink.write(output_name(item.name, result["enhanced_image"]), result["enhanced_image"])
+            item.status = DONE
+        except Exception as e:
+            item.error = e
+            item.status = FAILED
+        item.finished_at = time.time()
+
+    def run(self):
+        """Enhance every item, returning the sink once all have finished
+
+        Items are bulk work: they queue for backend slots behind interactive
+        runs and wait for them without timing out, so a concurrency above the
+        number of slots only means more items waiting, not failing.
+        """
+        owner, _ = scheduler.identity()
+        identity = (owner, scheduler.BULK)
+        self.started_at = time.time()
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch") as pool:
+                # Each worker loads its input only when it picks the item up
+                list(pool.map(lambda item: self._process(item, identity), self.items))
+        finally:
+            self.sink.close()
+            self.finished = True
+        return self.sink
+
+    def start(self, owner=None):
+        """Run the batch on a thread of its own as owner's, returning at once
+
+        A batch can take as long as all of its items, so it is not run as a
+        job: it would hold one of the few job workers throughout, and
+        interactive jobs would queue behind other sessions' batches. Its items
+        compete with other work only for backend slots, as bulk work.
+        """
+        def run():
+            with scheduler.acting_as(owner, scheduler.BULK, background=True):
+                self.run()
+        threading.Thread(target=run, name=f"batch-{self.id[:8]}", daemon=True).start()
+
+
+def prune_archives(directory=config.BATCH_DIR, retention=config.BATCH_RETENTION):
+    """Delete archives under directory older than retention seconds"""
+    cutoff = time.time() - retention
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            if name.endswith(".zip") and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def zip_batch(items, concurrency=config.BATCH_CONCURRENCY, **settings):
+    """Batch whose results are collected in a new ZIP archive under BATCH_DIR
+
+    Archives older than BATCH_RETENTION are deleted first, so abandoned ones
+    do not pile up.
+    """
+    prune_archives()
+    sink = ZipSink(os.path.join(config.BATCH_DIR, f"{uuid.uuid4().hex}.zip"))
+    return Batch(items, sink, concurrency, **settings)
@@ -0,0 +1,124 @@
+"""Process-wide cache for the model and preset catalog served by the backend
+
+Streamlit re-executes app.py on every widget interaction, but imported modules
+stay loaded for the life of the server process. Keeping the catalog here means
+all sessions share one copy and a rerun only costs a dict lookup.
+"""
+import threading
+import time
+
+from .client import get_json
+
+# Seconds a fetched catalog is served without asking the backend again
+CATALOG_TTL = 300
+# Seconds past the TTL a stale catalog may still be served while it refreshes
+CATALOG_MAX_STALE = 3600
+# Seconds to wait before retrying a backend that just failed
+CATALOG_ERROR_TTL = 15
+
+
+class CatalogEntry:
+    """A cached catalog response and its validation state"""
+
+    def __init__(self):
+        self.value = None
+        self.etag = None
+        self.fetched_at = None
+        self.error = None
+        self.failed_at = None
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+    def age(self, now):
+        if self.fetched_at is None:
+            return None
+        return now - self.fetched_at
+
+
+class CatalogCache:
+    """TTL cache with stale-while-revalidate refresh and ETag revalidation"""
+
+    def __init__(self, fetch=get_json, ttl=CATALOG_TTL, max_stale=CATALOG_MAX_STALE,
+                 error_ttl=CATALOG_ERROR_TTL):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.error_ttl = error_ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                entry = self._entries[url] = CatalogEntry()
+            return entry
+
+    def get(self, url):
+        """Return the catalog at url, refreshing it in the background when stale"""
+        entry = self._entry(url)
+        now = time.monotonic()
+        age = entry.age(now)
+
+        if age is not None and age < self.ttl:
+            return entry.value
+
+        if age is not None and age < self.ttl + self.max_stale:
+            self._refresh_in_background(url, entry)
+            return entry.value
+
+        # Nothing usable cached; fetch inline, letting one caller do the work
+        with entry.lock:
+            age = entry.age(time.monotonic())
+            if age is not None and age < self.ttl + self.max_stale:
+                return entry.value
+            if entry.failed_at is not None and time.monotonic() - entry.failed_at < self.error_ttl:
+                raise entry.error
+            self._revalidate(url, entry)
+            if entry.error is not None:
+                raise entry.error
+            return entry.value
+
+    def _refresh_in_background(self, url, entry):
+        with self._lock:
+            if entry.refreshing:
+                return
+            if entry.failed_at is not None and time.monotonic() - entry.failed_at < self.error_ttl:
+                return
+            entry.refreshing = True
+
+        def refresh():
+            try:
+                with entry.lock:
+                    self._revalidate(url, entry)
+            finally:
+                entry.refreshing = False
+
+        threading.Thread(target=refresh, name="catalog-refresh", daemon=True).start()
+
+    def _revalidate(self, url, entry):
+        try:
+            value, etag = self._fetch(url, entry.etag)
+        except Exception as e:
+            entry.error = e
+            entry.failed_at = time.monotonic()
+            return
+        if value is not None or entry.value is not None:
+            if value is not None:
+                entry.value = value
+            entry.etag = etag
+            entry.fetched_at = time.monotonic()
+        entry.error = None
+        entry.failed_at = None
+
+    def invalidate(self, url=None):
+        """Drop one cached catalog, or all of them"""
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(url, None)
+
+
+# Shared by every Streamlit session in this process
+catalog = CatalogCache()
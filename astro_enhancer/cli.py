@@ -0,0 +1,101 @@
+"""Command-line interface: python -m astro_enhancer --help"""
+import argparse
+import glob
+import os
+import sys
+
+from . import config
+from .processing import STRETCHES, Processing
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".tif", ".tiff")
+
+
+def expand_inputs(paths):
+    """Input files from a mix of files, directories and glob patterns"""
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(path, name)
+        elif any(c in path for c in "*?["):
+            yield from sorted(glob.glob(path))
+        else:
+            yield path
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="astro_enhancer", description="Astronomy Image Enhancer client")
+    parser.add_argument("--api-url", help="use only this backend (default: balance across %s)" % ", ".join(config.BACKEND_URLS))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("models", help="list available upscaler models")
+    commands.add_parser("presets", help="list available enhancement presets")
+
+    enhance = commands.add_parser("enhance", help="enhance one or more images")
+    enhance.add_argument("inputs", nargs="+", help="image files, directories or glob patterns")
+    enhance.add_argument("-o", "--output-dir", default=".", help="where enhanced images are written")
+    enhance.add_argument("-m", "--model", default=config.DEFAULT_MODEL)
+    enhance.add_argument("-p", "--preset", default=config.DEFAULT_PRESET)
+    enhance.add_argument("--prompt", help="custom enhancement description")
+    enhance.add_argument("--noise-level", type=float, default=20.0)
+    enhance.add_argument("--scientific", action="store_true", help="scientific accuracy mode")
+    enhance.add_argument("--no-cache", action="store_true", help="always run the upscaler")
+    enhance.add_argument("--no-downscale", action="store_true", help="upload images at full size")
+    enhance.add_argument("--tiled", action="store_true", help="enhance large images tile by tile")
+    enhance.add_argument("--subtract-background", action="store_true",
+                         help="remove sky background and gradients before upload")
+    enhance.add_argument("--stretch", choices=STRETCHES, help="stretch faint detail before upload")
+    enhance.add_argument("--stretch-strength", type=float, default=10.0)
+    enhance.add_argument("--denoise", type=float, default=0.0,
+                         help="local denoise of the result, 0 to 1, sparing stars (default: off)")
+    enhance.add_argument("-j", "--concurrency", type=int, default=config.BATCH_CONCURRENCY,
+                         help="parallel requests (default: %(default)s)")
+    return parser
+
+
+def run_enhance(args):
+    from .batch import DONE, Batch, BatchItem, FolderSink
+
+    def loader(path):
+        def load():
+            with open(path, "rb") as f:
+                return f.read()
+        return load
+
+    items = [BatchItem(os.path.basename(path), loader(path)) for path in expand_inputs(args.inputs)]
+    if not items:
+        print("no input images found", file=sys.stderr)
+        return 2
+
+    batch = Batch(items, FolderSink(args.output_dir), args.concurrency, model_name=args.model,
+                  preset=args.preset, custom_prompt=args.prompt, noise_level=args.noise_level,
+                  scientific_mode=args.scientific, cacheable=not args.no_cache,
+                  downscale=not args.no_downscale, tiled=args.tiled, base_url=args.api_url,
+                  preprocess=Processing(args.stretch, args.stretch_strength, args.subtract_background),
+                  postprocess=Processing(denoise=args.denoise))
+    batch.run()
+
+    failed = 0
+    for item in items:
+        if item.status == DONE:
+            print(f"{item.name} -> {item.output} ({item.duration:.1f}s)")
+        else:
+            failed += 1
+            print(f"{item.name} failed: {item.error}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "enhance":
+        return run_enhance(args)
+
+    from .api import list_models, list_presets
+    listing = list_models if args.command == "models" else list_presets
+    try:
+        for name in listing(args.api_url):
+            print(name)
+    except Exception as e:
+        print(f"Error connecting to API: {e}", file=sys.stderr)
+        return 1
+    return 0
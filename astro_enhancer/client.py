@@ -0,0 +1,206 @@
+"""Pooled HTTP client for the enhancement API
+
+One keep-alive session is shared by the whole process, so repeated calls reuse
+the TCP/TLS connection to the tunnel instead of handshaking every time.
+"""
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import config, metrics, scheduler, transport
+from .scheduler import FairGate
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class APIError(Exception):
+    """The backend answered with a non-success status"""
+
+    def __init__(self, status_code, text):
+        super().__init__(f"HTTP {status_code}: {text}")
+        self.status_code = status_code
+        self.text = text
+
+
+class BackendBusy(Exception):
+    """Too many enhancement requests are already in flight"""
+
+
+_session = None
+_session_lock = threading.Lock()
+_enhance_slots = FairGate(config.MAX_ENHANCE_IN_FLIGHT)
+
+
+def get_session():
+    """Return the process-wide keep-alive session"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=config.POOL_SIZE, pool_maxsize=config.POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            # Skips the ngrok interstitial page on free tunnels
+            session.headers["ngrok-skip-browser-warning"] = "1"
+            _session = session
+        return _session
+
+
+def timeout_for(url):
+    """(connect, read) timeout for the endpoint addressed by url"""
+    path = urlsplit(url).path
+    for endpoint, timeout in config.TIMEOUTS.items():
+        if path.endswith(endpoint):
+            return timeout
+    return config.DEFAULT_TIMEOUT
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, honouring a Retry-After hint"""
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), config.BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(config.BACKOFF_MAX, config.BACKOFF_BASE * 2 ** attempt))
+
+
+def request(method, url, rewind=None, idempotent=None, retries=None, **kwargs):
+    """Send a request with timeouts and bounded, jittered retries
+
+    rewind is called before every retry so file bodies can be re-read.
+    Read timeouts are only retried for idempotent requests, since the backend
+    may still be working on a POST that timed out. retries overrides
+    MAX_RETRIES, e.g. 0 when another backend can take the request instead.
+    """
+    if retries is None:
+        retries = config.MAX_RETRIES
+    if idempotent is None:
+        idempotent = method.upper() in ("GET", "HEAD")
+    kwargs.setdefault("timeout", timeout_for(url))
+    session = get_session()
+
+    for attempt in range(retries + 1):
+        last_attempt = attempt == retries
+        if attempt and rewind is not None:
+            rewind()
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.ConnectionError:
+            if last_attempt:
+                raise
+            metrics.registry.inc("retries_total", status="connection_error")
+            time.sleep(backoff_delay(attempt))
+            continue
+        except requests.Timeout:
+            if last_attempt or not idempotent:
+                raise
+            metrics.registry.inc("retries_total", status="timeout")
+            time.sleep(backoff_delay(attempt))
+            continue
+
+        if response.status_code in RETRY_STATUSES and not last_attempt:
+            retry_after = response.headers.get("Retry-After")
+            response.close()
+            metrics.registry.inc("retries_total", status=response.status_code)
+            time.sleep(backoff_delay(attempt, retry_after))
+            continue
+        return response
+
+
+def get_json(url, etag=None, retries=None):
+    """GET a JSON document, returning (value, etag) or (None, etag) when unchanged"""
+    headers = {"If-None-Match": etag} if etag else {}
+    response = request("GET", url, headers=headers, retries=retries)
+    if response.status_code == 304:
+        return None, etag
+    if response.status_code != 200:
+        raise APIError(response.status_code, response.text)
+    return response.json(), response.headers.get("ETag")
+
+
+def fetch_image(base_url, result_id, name, image_format=None):
+    """Stream one result image as raw bytes from /results/<id>/<name>"""
+    params = {"format": image_format or config.RESULT_FORMAT}
+    with metrics.phase("fetch_image") as timing:
+        response = request("GET", f"{base_url}/results/{result_id}/{name}", params=params, stream=True)
+        with response:
+            if response.status_code != 200:
+                raise APIError(response.status_code, response.text)
+            data = transport.read_body(response)
+        timing["bytes"] = len(data)
+    return data
+
+
+def read_result(base_url, response, image_format=None):
+    """Decode an /enhance_image response, whatever shape the backend used"""
+    content_type = response.headers.get("Content-Type", "")
+    with metrics.phase("download") as timing:
+        body = transport.read_body(response)
+        timing["bytes"] = len(body)
+    with metrics.phase("decode"):
+        if content_type.startswith("multipart/"):
+            return transport.parse_multipart(content_type, body)
+        result = transport.parse_json(body)
+
+    if not isinstance(result, dict):
+        raise APIError(response.status_code, bytes(body[:500]).decode("utf-8", "replace"))
+    if result.get("enhanced_image") is None and result.get("result_id"):
+        result_id = result["result_id"]
+        result["enhanced_image"] = fetch_image(base_url, result_id, "enhanced_image", image_format)
+        # The before/after pair is just the upload and the result; the UI
+        # builds it locally when asked instead of downloading both again
+        result["before_after"] = []
+    if not isinstance(result.get("enhanced_image"), bytes):
+        # e.g. {"detail": ...} with a 200; never hand it on to be cached as a result
+        raise APIError(response.status_code, bytes(body[:500]).decode("utf-8", "replace"))
+    return result
+
+
+def enhance_image(base_url, image_file, filename, mime_type, data, image_format=None, retries=None,
+                  progress=None):
+    """POST an image to /enhance_image and return the decoded result
+
+    The image is streamed from image_file rather than buffered, reporting
+    progress(sent, total) in bytes. Binary responses are preferred over
+    base64-in-JSON; see transport.py for the accepted shapes. At most
+    MAX_ENHANCE_IN_FLIGHT calls run at once per process; callers beyond that
+    are admitted fairly across sessions (see scheduler.py). Callers outside
+    a background job wait up to ENHANCE_QUEUE_TIMEOUT seconds before they
+    get BackendBusy; background jobs (and their tiles) and bulk work (batch
+    items) hold up nobody, so they wait for their turn however long it takes.
+    """
+    _, priority = scheduler.identity()
+    patient = priority == scheduler.BULK or scheduler.in_background()
+    timeout = None if patient else config.ENHANCE_QUEUE_TIMEOUT
+    with metrics.phase("client_queue"):
+        ticket = _enhance_slots.acquire(timeout=timeout)
+    if ticket is None:
+        raise BackendBusy("The enhancement backend is busy, please try again shortly")
+    try:
+        fields = {**data, "response_format": image_format or config.RESULT_FORMAT, "include_before_after": "false"}
+        body = transport.MultipartBody(fields,
+                                       "image", filename, image_file, mime_type, progress)
+        response = request(
+            "POST",
+            f"{base_url}/enhance_image",
+            data=body,
+            headers={"Accept": transport.ACCEPT, "Content-Type": body.content_type},
+            rewind=body.rewind,
+            retries=retries,
+            stream=True,
+        )
+        # Time to response headers: upload, backend queueing and inference
+        metrics.record("request", response.elapsed.total_seconds(), body.file_size)
+        for name, seconds in metrics.parse_server_timing(response.headers.get("Server-Timing")):
+            metrics.record(f"backend.{name}", seconds)
+        with response:
+            if response.status_code != 200:
+                raise APIError(response.status_code, response.text)
+            return read_result(base_url, response, image_format)
+    finally:
+        _enhance_slots.release(ticket)
@@ -0,0 +1,152 @@
+"""Runtime configuration, read from the environment (or a local .env file)"""
+import os
+import tempfile
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _float(name, default):
+    return float(os.environ.get(name, default))
+
+
+def _int(name, default):
+    return int(os.environ.get(name, default))
+
+
+# FastAPI server URL
+API_URL = os.environ.get("ASTRO_API_URL", "https://248f-132-249-252-216.ngrok-free.app").rstrip("/")
+
+
+def _backend_urls():
+    """API_URL, then ASTRO_API_URLS (comma-separated), then one URL per line of the backends file"""
+    urls = [API_URL] + os.environ.get("ASTRO_API_URLS", "").split(",")
+    path = os.environ.get("ASTRO_BACKENDS_FILE", os.path.join(os.path.dirname(os.path.dirname(__file__)), "APIs.txt"))
+    if os.path.exists(path):
+        with open(path) as f:
+            urls += [line.strip() for line in f if not line.lstrip().startswith("#")]
+    return list(dict.fromkeys(url.rstrip("/") for url in urls if url.strip()))
+
+
+# Every enhancement backend the client may fail over between
+BACKEND_URLS = _backend_urls()
+# Seconds between background health checks of the backend pool
+HEALTH_CHECK_INTERVAL = _float("ASTRO_HEALTH_CHECK_INTERVAL", 30)
+# Seconds an unhealthy backend is left alone before being probed again
+UNHEALTHY_COOLDOWN = _float("ASTRO_UNHEALTHY_COOLDOWN", 15)
+
+# (connect, read) timeouts in seconds, per endpoint
+TIMEOUTS = {
+    "/models": (_float("ASTRO_CONNECT_TIMEOUT", 3.05), _float("ASTRO_CATALOG_TIMEOUT", 10)),
+    "/presets": (_float("ASTRO_CONNECT_TIMEOUT", 3.05), _float("ASTRO_CATALOG_TIMEOUT", 10)),
+    "/enhance_image": (_float("ASTRO_CONNECT_TIMEOUT", 3.05), _float("ASTRO_ENHANCE_TIMEOUT", 300)),
+}
+DEFAULT_TIMEOUT = (3.05, 30)
+
+# Retry policy for 5xx, 429 and connection failures
+MAX_RETRIES = _int("ASTRO_MAX_RETRIES", 3)
+BACKOFF_BASE = _float("ASTRO_BACKOFF_BASE", 0.5)
+BACKOFF_MAX = _float("ASTRO_BACKOFF_MAX", 8)
+
+# Connection pool shared by every session in the process
+POOL_SIZE = _int("ASTRO_POOL_SIZE", 16)
+
+# Backpressure on the GPU backend
+MAX_ENHANCE_IN_FLIGHT = _int("ASTRO_MAX_ENHANCE_IN_FLIGHT", 4)
+ENHANCE_QUEUE_TIMEOUT = _float("ASTRO_ENHANCE_QUEUE_TIMEOUT", 30)
+# Slots (jobs and backend calls) one session may hold while others are waiting
+SESSION_QUOTA = _int("ASTRO_SESSION_QUOTA", 2)
+
+# Enhancement result cache
+RESULT_CACHE_DIR = os.environ.get(
+    "ASTRO_RESULT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "astro_enhancer", "results")
+)
+RESULT_CACHE_MEMORY_ITEMS = _int("ASTRO_RESULT_CACHE_MEMORY_ITEMS", 32)
+RESULT_CACHE_MEMORY_MB = _int("ASTRO_RESULT_CACHE_MEMORY_MB", 256)
+RESULT_CACHE_DISK_MB = _int("ASTRO_RESULT_CACHE_DISK_MB", 2048)
+
+# Background enhancement jobs
+JOB_WORKERS = _int("ASTRO_JOB_WORKERS", MAX_ENHANCE_IN_FLIGHT)
+JOB_RETENTION = _float("ASTRO_JOB_RETENTION", 3600)
+# Assumed duration of a run before any have been timed
+JOB_DEFAULT_DURATION = _float("ASTRO_JOB_DEFAULT_DURATION", 60)
+# Runs expected to take at most this long are scheduled as interactive
+JOB_QUICK_DURATION = _float("ASTRO_JOB_QUICK_DURATION", 20)
+# Seconds between UI polls of a running job
+JOB_POLL_INTERVAL = _float("ASTRO_JOB_POLL_INTERVAL", 1.0)
+# Longest gap between polls, used while a run still has far to go
+JOB_POLL_MAX_INTERVAL = _float("ASTRO_JOB_POLL_MAX_INTERVAL", 5.0)
+
+# Memory budget for result images held by Streamlit sessions; beyond it the
+# least recently used ones are spilled to disk
+SESSION_MEMORY_MB = _int("ASTRO_SESSION_MEMORY_MB", 128)
+SESSION_STORE_MEMORY_MB = _int("ASTRO_SESSION_STORE_MEMORY_MB", 1024)
+SESSION_SPILL_DIR = os.environ.get(
+    "ASTRO_SESSION_SPILL_DIR", os.path.join(tempfile.gettempdir(), "astro_enhancer", "sessions")
+)
+
+# Image encoding the backend is asked to return results in ("png" or "webp")
+RESULT_FORMAT = os.environ.get("ASTRO_RESULT_FORMAT", "png").lower()
+
+# Encoded renditions kept per session for display and download
+RENDER_CACHE_ITEMS = _int("ASTRO_RENDER_CACHE_ITEMS", 8)
+# Longest edge of the in-page previews
+PREVIEW_MAX_SIZE = _int("ASTRO_PREVIEW_MAX_SIZE", 1024)
+PREVIEW_FORMAT = os.environ.get("ASTRO_PREVIEW_FORMAT", "WEBP").upper()
+PREVIEW_QUALITY = _int("ASTRO_PREVIEW_QUALITY", 85)
+
+# Deep-zoom tile pyramids for the magnifier, written where Streamlit's static
+# file serving (see .streamlit/config.toml) makes them available at PYRAMID_URL
+PYRAMID_DIR = os.environ.get(
+    "ASTRO_PYRAMID_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "static", "pyramids")
+)
+PYRAMID_URL = os.environ.get("ASTRO_PYRAMID_URL", "app/static/pyramids").rstrip("/")
+PYRAMID_TILE_SIZE = _int("ASTRO_PYRAMID_TILE_SIZE", 256)
+# Results whose pyramids are kept on disk
+PYRAMID_MAX_ITEMS = _int("ASTRO_PYRAMID_MAX_ITEMS", 32)
+# Initial magnification of the glass, relative to the image as displayed
+MAGNIFIER_ZOOM = _float("ASTRO_MAGNIFIER_ZOOM", 3)
+MAGNIFIER_HEIGHT = _int("ASTRO_MAGNIFIER_HEIGHT", 600)
+
+# Longest input edge each upscaler handles well; bigger uploads are downscaled
+# first, since a 4x model would otherwise produce an absurd output resolution
+MODEL_MAX_INPUT = {
+    "Stable Diffusion Upscaler (4x)": 512,
+    "ESRGAN Plus (4x)": 1024,
+    "SwinIR (4x)": 1024,
+    "Codeformer (Face Enhancement)": 1024,
+    "Real-ESRGAN (4x)": 1024,
+}
+DEFAULT_MAX_INPUT = _int("ASTRO_DEFAULT_MAX_INPUT", 1024)
+# JPEG quality used when a lossy upload has to be re-encoded
+UPLOAD_JPEG_QUALITY = _int("ASTRO_UPLOAD_JPEG_QUALITY", 95)
+
+# Tiled enhancement of images too large for a single pass
+TILE_OVERLAP = _int("ASTRO_TILE_OVERLAP", 32)
+TILE_WORKERS = _int("ASTRO_TILE_WORKERS", MAX_ENHANCE_IN_FLIGHT)
+
+# Enhancement history: content-addressed images, a SQLite index and thumbnails
+HISTORY_DIR = os.environ.get(
+    "ASTRO_HISTORY_DIR", os.path.join(os.path.expanduser("~"), ".astro_enhancer", "history")
+)
+HISTORY_THUMB_SIZE = _int("ASTRO_HISTORY_THUMB_SIZE", 256)
+HISTORY_PAGE_SIZE = _int("ASTRO_HISTORY_PAGE_SIZE", 24)
+HISTORY_MAX_MB = _int("ASTRO_HISTORY_MAX_MB", 2048)
+# List every session's runs to everyone (a public gallery); off, each session sees only its own
+HISTORY_SHARED = os.environ.get("ASTRO_HISTORY_SHARED", "").lower() in ("1", "true", "yes")
+
+# Batch enhancement
+BATCH_DIR = os.environ.get("ASTRO_BATCH_DIR", os.path.join(tempfile.gettempdir(), "astro_enhancer", "batches"))
+BATCH_CONCURRENCY = _int("ASTRO_BATCH_CONCURRENCY", 2)
+# Seconds a batch's ZIP archive is kept for download
+BATCH_RETENTION = _float("ASTRO_BATCH_RETENTION", JOB_RETENTION)
+
+# Defaults for scripted use
+DEFAULT_MODEL = os.environ.get("ASTRO_DEFAULT_MODEL", "Stable Diffusion Upscaler (4x)")
+DEFAULT_PRESET = os.environ.get("ASTRO_DEFAULT_PRESET", "General Astronomy")
+
+# Instrumentation: Prometheus-style metrics served on a port and/or written to a file
+METRICS_PORT = _int("ASTRO_METRICS_PORT", 0)
+METRICS_FILE = os.environ.get("ASTRO_METRICS_FILE")
+LOG_LEVEL = os.environ.get("ASTRO_LOG_LEVEL", "INFO").upper()
@@ -0,0 +1,240 @@
+"""Persistent history of enhancement runs
+
+Results used to live only in a session. Each run is now recorded on disk:
+
+* blobs/<sha[:2]>/<sha>: input and output images, stored once per content, so
+  re-enhancing the same file or getting a cached result costs no new space
+* thumbs/<sha>.webp: a thumbnail of every output, made when the run is
+  recorded, so the gallery never decodes a full-size image
+* history.db: a SQLite index of runs with their settings and prompts, paged
+  by creation time
+
+Reopening a run reads its blobs back; the upscaler is not involved. Runs
+belong to the session (owner) that made them and are only listed to it,
+unless HISTORY_SHARED turns the history into a gallery for everyone. Beyond
+HISTORY_MAX_MB of images, the oldest runs are deleted.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from PIL import Image
+
+from . import config, metrics, pipeline, scheduler
+from .rendering import resize
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    owner TEXT,
+    filename TEXT,
+    model TEXT,
+    preset TEXT,
+    custom_prompt TEXT,
+    noise_level REAL,
+    scientific INTEGER,
+    settings TEXT,
+    prompt_used TEXT,
+    input_sha TEXT NOT NULL,
+    output_sha TEXT NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    seconds REAL
+);
+CREATE INDEX IF NOT EXISTS runs_created ON runs (created DESC);
+CREATE INDEX IF NOT EXISTS runs_model ON runs (model, created DESC);
+CREATE INDEX IF NOT EXISTS runs_owner ON runs (owner, created DESC);
+CREATE INDEX IF NOT EXISTS runs_input ON runs (input_sha);
+CREATE INDEX IF NOT EXISTS runs_output ON runs (output_sha);
+"""
+
+
+def _settings_json(options):
+    return json.dumps({k: v.as_dict() if hasattr(v, "as_dict") else v for k, v in options.items()},
+                      sort_keys=True, default=str)
+
+
+class HistoryStore:
+    """Runs indexed in SQLite, with their images stored once by content hash"""
+
+    def __init__(self, root=config.HISTORY_DIR, thumb_size=config.HISTORY_THUMB_SIZE,
+                 max_mb=config.HISTORY_MAX_MB):
+        self.root = root
+        self.thumb_size = thumb_size
+        self.max_bytes = max_mb << 20
+        self._db = None
+        self._bytes = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Opened on first use, so importing the module touches no files
+        if self._db is None:
+            os.makedirs(self.root, exist_ok=True)
+            db = sqlite3.connect(os.path.join(self.root, "history.db"), check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+            self._db = db
+        return self._db
+
+    def blob_path(self, sha):
+        return os.path.join(self.root, "blobs", sha[:2], sha)
+
+    def thumb_path(self, sha):
+        return os.path.join(self.root, "thumbs", f"{sha}.webp")
+
+    def _write(self, path, data):
+        """Write data to path unless it is already there; the number of bytes written"""
+        if os.path.exists(path):
+            return 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return len(data)
+
+    def put_blob(self, data):
+        """Store image bytes once; their content hash and the bytes newly written"""
+        sha = hashlib.sha256(data).hexdigest()
+        written = self._write(self.blob_path(sha), data)
+        if written:
+            metrics.registry.inc("history_blob_bytes_total", written)
+        return sha, written
+
+    def load_blob(self, sha):
+        with open(self.blob_path(sha), "rb") as f:
+            return f.read()
+
+    def record(self, input_data, filename, result, model_name, preset, custom_prompt=None, noise_level=20.0,
+               scientific_mode=False, owner=None, **options):
+        """Store one finished run of owner's and return its id"""
+        with metrics.phase("history") as timing:
+            input_sha, written = self.put_blob(input_data)
+            output = result["enhanced_image"]
+            output_sha, written_output = self.put_blob(output)
+            written += written_output
+            if not os.path.exists(self.thumb_path(output_sha)):
+                written += self._write(self.thumb_path(output_sha), resize(output, self.thumb_size).data)
+            width, height = Image.open(self.blob_path(output_sha)).size
+            timing["bytes"] = len(input_data) + len(output)
+        seconds = (result.get("timings") or {}).get("total")
+        with self._lock:
+            db = self._connect()
+            cursor = db.execute(
+                "INSERT INTO runs (created, owner, filename, model, preset, custom_prompt, noise_level, scientific,"
+                " settings, prompt_used, input_sha, output_sha, width, height, seconds)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), owner, filename, model_name, preset, custom_prompt, noise_level, int(scientific_mode),
+                 _settings_json(options), result.get("prompt_used"), input_sha, output_sha, width, height,
+                 seconds),
+            )
+            if self._bytes is None:
+                self._bytes = self._disk_usage()
+            else:
+                self._bytes += written
+            if self._bytes > self.max_bytes:
+                self._evict(db)
+            db.commit()
+            return cursor.lastrowid
+
+    def _disk_usage(self):
+        total = 0
+        for directory in ("blobs", "thumbs"):
+            for root, _, names in os.walk(os.path.join(self.root, directory)):
+                for name in names:
+                    try:
+                        total += os.path.getsize(os.path.join(root, name))
+                    except FileNotFoundError:
+                        pass
+        return total
+
+    def _evict(self, db):
+        """Delete the oldest runs, and images no run refers to any more, until under max_bytes"""
+        while self._bytes > self.max_bytes:
+            rows = db.execute("SELECT id, input_sha, output_sha FROM runs ORDER BY created LIMIT 64").fetchall()
+            if not rows:
+                break
+            for row in rows:
+                if self._bytes <= self.max_bytes:
+                    break
+                db.execute("DELETE FROM runs WHERE id = ?", (row["id"],))
+                metrics.registry.inc("history_evictions_total")
+                for sha in {row["input_sha"], row["output_sha"]}:
+                    if db.execute("SELECT 1 FROM runs WHERE input_sha = ? OR output_sha = ? LIMIT 1",
+                                  (sha, sha)).fetchone() is None:
+                        self._bytes -= self._remove(sha)
+
+    def _remove(self, sha):
+        """Delete an image and its thumbnail; the bytes freed"""
+        freed = 0
+        for path in (self.blob_path(sha), self.thumb_path(sha)):
+            try:
+                freed += os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return freed
+
+    def _where(self, owner=None, model=None, search=None):
+        """SQL filter for runs; owner None matches every owner's runs"""
+        clauses, params = [], []
+        if owner is not None:
+            clauses.append("owner = ?")
+            params.append(owner)
+        if model:
+            clauses.append("model = ?")
+            params.append(model)
+        if search:
+            clauses.append("(filename LIKE ? OR prompt_used LIKE ? OR custom_prompt LIKE ? OR preset LIKE ?)")
+            params += [f"%{search}%"] * 4
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def count(self, owner=None, model=None, search=None):
+        where, params = self._where(owner, model, search)
+        with self._lock:
+            return self._connect().execute(f"SELECT COUNT(*) FROM runs{where}", params).fetchone()[0]
+
+    def page(self, offset=0, limit=config.HISTORY_PAGE_SIZE, owner=None, model=None, search=None):
+        """Runs newest first, as dicts"""
+        where, params = self._where(owner, model, search)
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT * FROM runs{where} ORDER BY created DESC LIMIT ? OFFSET ?", params + [limit, offset]
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, run_id, owner=None):
+        """The run with this id, or None if there is none (of owner's, when given)"""
+        where, params = self._where(owner)
+        where = f"{where} AND id = ?" if where else " WHERE id = ?"
+        with self._lock:
+            row = self._connect().execute(f"SELECT * FROM runs{where}", params + [run_id]).fetchone()
+        return dict(row) if row is not None else None
+
+    def models(self, owner=None):
+        """Models that appear in the history (of owner's runs, when given)"""
+        where, params = self._where(owner)
+        with self._lock:
+            rows = self._connect().execute(f"SELECT DISTINCT model FROM runs{where} ORDER BY model", params)
+            return [row[0] for row in rows]
+
+
+def enhance_and_record(image_file, filename, model_name, preset, custom_prompt=None, noise_level=20.0,
+                       scientific_mode=False, **options):
+    """pipeline.enhance, then record the run in the history as the job's owner's (for background jobs)"""
+    result = pipeline.enhance(image_file, filename, model_name, preset, custom_prompt, noise_level,
+                              scientific_mode, **options)
+    image_file.seek(0)
+    owner, _ = scheduler.identity()
+    result["history_id"] = history.record(image_file.read(), filename, result, model_name, preset,
+                                          custom_prompt, noise_level, scientific_mode, owner=owner, **options)
+    return result
+
+
+# Shared by every Streamlit session in this process
+history = HistoryStore()
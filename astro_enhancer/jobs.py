@@ -0,0 +1,242 @@
+"""Background job queue for long-running enhancement calls
+
+A Streamlit script thread only submits work and polls for it, so a minute-long
+diffusion run no longer pins a server thread, and the run keeps going (and its
+result stays collectable) across reruns of the page. Queued jobs are started
+by priority and fairly across sessions (see scheduler.py), not in arrival order.
+"""
+import itertools
+import threading
+import time
+import uuid
+
+from . import config
+from .scheduler import INTERACTIVE, STANDARD, FairQueue, acting_as
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Weight of the newest run in the moving average of durations
+DURATION_SMOOTHING = 0.3
+
+# The job each worker thread is running
+_current = threading.local()
+
+
+def upload_reporter():
+    """Callback recording upload progress on the job running in this thread, or None outside a job"""
+    job = getattr(_current, "job", None)
+    if job is None:
+        return None
+
+    def report(sent, total):
+        job.upload_progress = (sent, total)
+    return report
+
+
+class Job:
+    """One unit of work and its lifecycle"""
+
+    def __init__(self, fn, args, kwargs, label, owner=None, priority=STANDARD):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.label = label
+        self.owner = owner
+        self.priority = priority
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.expected_duration = None
+        # (bytes sent, bytes total) while the image is being uploaded
+        self.upload_progress = None
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    @property
+    def uploading(self):
+        return self.upload_progress is not None and self.upload_progress[0] < self.upload_progress[1]
+
+    def progress(self, now=None):
+        """Estimated completion in [0, 1], based on how long similar runs took"""
+        if self.finished:
+            return 1.0
+        if self.started_at is None:
+            return 0.0
+        elapsed = (now or time.time()) - self.started_at
+        # Never claim to be done before the backend says so
+        return min(elapsed / self.expected_duration, 0.95)
+
+
+class JobManager:
+    """Fixed pool of worker threads draining a fair-share queue of jobs"""
+
+    def __init__(self, workers=config.JOB_WORKERS, retention=config.JOB_RETENTION):
+        self.workers = workers
+        self.retention = retention
+        self._jobs = {}
+        self._pending = FairQueue()
+        self._durations = {}
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"enhance-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, fn, *args, label=None, owner=None, priority=None, **kwargs):
+        """Queue fn(*args, **kwargs) for owner (a session) and return the new job's id
+
+        priority defaults to priority_for(label).
+        """
+        with self._cond:
+            if priority is None:
+                priority = self._priority_for(label)
+            job = Job(fn, args, kwargs, label, owner, priority)
+            self._prune()
+            self._start_workers()
+            job.expected_duration = self._durations.get(label, config.JOB_DEFAULT_DURATION)
+            self._jobs[job.id] = job
+            self._pending.push(job, owner, priority)
+            self._cond.notify()
+        return job.id
+
+    def priority_for(self, label):
+        """INTERACTIVE for runs of this label expected to be quick, STANDARD for slower ones"""
+        with self._cond:
+            return self._priority_for(label)
+
+    def _priority_for(self, label):
+        duration = self._durations.get(label, config.JOB_DEFAULT_DURATION)
+        return INTERACTIVE if duration <= config.JOB_QUICK_DURATION else STANDARD
+
+    def get(self, job_id):
+        """The job with this id, or None if it is unknown or expired"""
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def collect(self, job_id):
+        """Hand a finished job to its caller and forget it, or None if it has not finished
+
+        Once collected, the manager no longer holds the job's result, so a
+        large image is only kept by whoever took it.
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or not job.finished:
+                return None
+            return self._jobs.pop(job_id)
+
+    def queue_position(self, job_id):
+        """1-based position among queued jobs in the order they will start, or 0 once the job has started"""
+        with self._cond:
+            for position, job in enumerate(self._pending.order(), 1):
+                if job.id == job_id:
+                    return position
+        return 0
+
+    def eta(self, job_id, now=None):
+        """Estimated seconds until the job finishes"""
+        now = now or time.time()
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return 0.0
+            if job.started_at is not None:
+                return max(job.expected_duration - (now - job.started_at), 0.0)
+            ahead = list(itertools.takewhile(lambda j: j is not job, self._pending.order()))
+            return self._wait(ahead, now) + job.expected_duration
+
+    def expected_wait(self, owner=None, label=None, priority=None, now=None):
+        """Estimated seconds before a job submitted now by owner would start"""
+        now = now or time.time()
+        probe = Job(None, (), {}, label, owner)
+        with self._cond:
+            if priority is None:
+                priority = self._priority_for(label)
+            self._pending.push(probe, owner, priority)
+            try:
+                ahead = list(itertools.takewhile(lambda j: j is not probe, self._pending.order()))
+            finally:
+                self._pending.remove(probe)
+            return self._wait(ahead, now)
+
+    def _wait(self, ahead, now):
+        # Everything ahead in the queue plus what is left of the running jobs,
+        # spread over the worker pool
+        running = [j for j in self._jobs.values() if j.status == RUNNING]
+        if len(running) + len(ahead) < self.workers:
+            return 0.0
+        backlog = sum(max(j.expected_duration - (now - j.started_at), 0.0) for j in running)
+        backlog += sum(j.expected_duration for j in ahead)
+        return backlog / self.workers
+
+    def queue_stats(self):
+        """Queued jobs per priority, running jobs and sessions with queued work"""
+        with self._cond:
+            return {
+                "queued": self._pending.depth(),
+                "running": sum(j.status == RUNNING for j in self._jobs.values()),
+                "sessions": len(self._pending.owners()),
+            }
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                job = self._pending.pop()
+                job.status = RUNNING
+                job.started_at = time.time()
+            _current.job = job
+            try:
+                # Backend calls made by the job are scheduled as its owner's
+                with acting_as(job.owner, job.priority, background=True):
+                    job.result = job.fn(*job.args, **job.kwargs)
+                job.status = DONE
+            except Exception as e:
+                job.error = e
+                job.status = FAILED
+            finally:
+                _current.job = None
+            job.finished_at = time.time()
+            with self._cond:
+                self._pending.done(job.owner)
+                if job.status == DONE:
+                    self._record_duration(job)
+                # Drop references to the inputs as soon as they are not needed
+                job.fn = job.args = job.kwargs = None
+                # Uncollected results expire even when nothing new is submitted
+                self._prune()
+
+    def _record_duration(self, job):
+        # Results served from the cache or by joining an identical run (nothing
+        # uploaded) take milliseconds and say nothing about the model's speed;
+        # counting them would drag down ETAs and promote slow models to interactive
+        if isinstance(job.result, dict) and job.result.get("upload", False) is None:
+            return
+        duration = job.finished_at - job.started_at
+        previous = self._durations.get(job.label)
+        if previous is None:
+            self._durations[job.label] = duration
+        else:
+            self._durations[job.label] = previous + DURATION_SMOOTHING * (duration - previous)
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+
+# Shared by every Streamlit session in this process
+jobs = JobManager()
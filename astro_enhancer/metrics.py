@@ -0,0 +1,253 @@
+"""Per-request timing traces and process-wide metrics
+
+A Trace records how long each phase of one enhancement took (preparing the
+upload, the backend round trip, downloading, decoding, ...) and how many
+bytes it moved. Code deep in the client records into whichever trace is
+active on the current thread, so nothing has to pass it around.
+
+Every finished trace is logged as one JSON line on the "astro_enhancer"
+logger and folded into a Prometheus-style registry, which can be served on
+ASTRO_METRICS_PORT and/or written to ASTRO_METRICS_FILE.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import config
+
+log = logging.getLogger("astro_enhancer")
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_local = threading.local()
+
+
+class Trace:
+    """Durations and byte counts of the phases of one operation"""
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+        self.phases = []
+        self.started = time.perf_counter()
+        self.total = None
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds, nbytes=None):
+        with self._lock:
+            self.phases.append({"phase": phase, "seconds": seconds, "bytes": nbytes})
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+        return self
+
+    def as_dict(self):
+        # Repeated phases (e.g. one request per tile) are summed
+        merged = {}
+        with self._lock:
+            for p in self.phases:
+                entry = merged.setdefault(p["phase"], {"phase": p["phase"], "seconds": 0.0, "bytes": None, "count": 0})
+                entry["seconds"] += p["seconds"]
+                entry["count"] += 1
+                if p["bytes"] is not None:
+                    entry["bytes"] = (entry["bytes"] or 0) + p["bytes"]
+        return {"name": self.name, "labels": self.labels, "total": self.total, "phases": list(merged.values())}
+
+
+def current_trace():
+    """The trace active on this thread, or None"""
+    return getattr(_local, "trace", None)
+
+
+@contextmanager
+def use_trace(trace):
+    """Make trace the active trace on this thread for the duration of the block"""
+    previous = current_trace()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+@contextmanager
+def traced(name, **labels):
+    """Start a new trace, make it active, and log and record it when done"""
+    trace = Trace(name, **labels)
+    status = "ok"
+    try:
+        with use_trace(trace):
+            yield trace
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        trace.finish()
+        registry.observe_trace(trace, status)
+        log.info(json.dumps({"event": "trace", "status": status, **trace.as_dict()}))
+
+
+@contextmanager
+def phase(name, nbytes=None):
+    """Time a block as one phase of the active trace (and of the registry)
+
+    The yielded dict may be updated with a "bytes" count discovered inside the block.
+    """
+    info = {"bytes": nbytes}
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        record(name, time.perf_counter() - start, info["bytes"])
+
+
+def record(name, seconds, nbytes=None):
+    """Record an already measured phase"""
+    trace = current_trace()
+    if trace is not None:
+        trace.add(name, seconds, nbytes)
+    registry.observe("phase_seconds", seconds, phase=name)
+    if nbytes:
+        registry.inc("phase_bytes_total", nbytes, phase=name)
+
+
+def parse_server_timing(header):
+    """[(name, seconds)] from a Server-Timing header such as 'queue;dur=120, infer;dur=5300'"""
+    timings = []
+    for metric in (header or "").split(","):
+        name, *params = [p.strip() for p in metric.split(";")]
+        for param in params:
+            if param.startswith("dur="):
+                try:
+                    timings.append((name, float(param[4:]) / 1000))
+                except ValueError:
+                    pass
+    return timings
+
+
+class Registry:
+    """Counters and histograms, rendered in the Prometheus text format"""
+
+    def __init__(self, prefix="astro_enhancer_"):
+        self.prefix = prefix
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def value(self, name, **labels):
+        """Current value of a counter or gauge, 0 if never recorded"""
+        key = self._key(name, labels)
+        with self._lock:
+            return self._counters.get(key, self._gauges.get(key, 0))
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    hist["buckets"][i] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def observe_trace(self, trace, status):
+        self.observe(f"{trace.name}_seconds", trace.total, status=status)
+        self.inc(f"{trace.name}_total", status=status)
+        if config.METRICS_FILE:
+            self.write(config.METRICS_FILE)
+
+    def render(self):
+        def labels_text(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"{self.prefix}{name}{labels_text(labels)} {value}")
+            for (name, labels), value in sorted(self._gauges.items()):
+                lines.append(f"{self.prefix}{name}{labels_text(labels)} {value}")
+            for (name, labels), hist in sorted(self._histograms.items()):
+                for bound, count in zip(BUCKETS, hist["buckets"]):
+                    lines.append(f"{self.prefix}{name}_bucket{labels_text(labels, [('le', bound)])} {count}")
+                lines.append(f"{self.prefix}{name}_bucket{labels_text(labels, [('le', '+Inf')])} {hist['count']}")
+                lines.append(f"{self.prefix}{name}_sum{labels_text(labels)} {hist['sum']}")
+                lines.append(f"{self.prefix}{name}_count{labels_text(labels)} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Atomically write the current metrics to path (e.g. for node_exporter's textfile collector)"""
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+registry = Registry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = registry.render().encode()
+        self.send_response(200 if self.path.split("?")[0] == "/metrics" else 404)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def configure_logging(level=config.LOG_LEVEL):
+    """Send this package's structured logs to stderr, unless already configured"""
+    if not log.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s"))
+        log.addHandler(handler)
+        log.setLevel(level)
+        log.propagate = False
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve_metrics(port=config.METRICS_PORT):
+    """Serve /metrics on port in a background thread (once per process)"""
+    global _server
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            except OSError as e:
+                log.warning("metrics endpoint not started: %s", e)
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        return _server
@@ -0,0 +1,122 @@
+"""The enhancement pipeline, independent of any UI"""
+import io
+
+from . import backends, metrics
+from .config import TILE_OVERLAP
+from .jobs import upload_reporter
+from .result_cache import cache_key, digest_file, inflight, results
+from .tiling import enhance_tiled
+from .upload import max_input_size, prepare_upload, stream_upload
+
+
+def enhance(image_file, filename, model_name, preset, custom_prompt=None, noise_level=20.0,
+            scientific_mode=False, cacheable=True, downscale=True, tiled=False, base_url=None,
+            preprocess=None, postprocess=None):
+    """Enhance an image, reusing cached results for identical runs
+
+    With downscale, inputs larger than the model can use are shrunk before
+    upload; with tiled, they are instead enhanced tile by tile at full size.
+    base_url pins one backend; by default the backend pool picks one.
+    preprocess and postprocess are processing.Processing steps run locally on
+    the input and on the enhanced image; results are cached before
+    postprocessing, so changing it never costs another backend run.
+    Returns the decoded result, with an "upload" entry describing what was
+    sent (None when served from cache) and a "timings" breakdown; raises
+    client.APIError, client.BackendBusy, backends.NoBackendAvailable or a
+    requests exception on failure.
+    """
+    with metrics.traced("enhance", model=model_name) as trace:
+        result = _enhance(image_file, filename, model_name, preset, custom_prompt, noise_level,
+                          scientific_mode, cacheable, downscale, tiled, base_url, preprocess)
+        if postprocess:
+            with metrics.phase("postprocess") as timing:
+                result = {**result, "enhanced_image": postprocess.apply(result["enhanced_image"])}
+                timing["bytes"] = len(result["enhanced_image"])
+    return {**result, "timings": trace.as_dict()}
+
+
+def _enhance(image_file, filename, model_name, preset, custom_prompt, noise_level, scientific_mode,
+             cacheable, downscale, tiled, base_url, preprocess=None):
+    max_size = None
+    if tiled:
+        variant = ["tiled", max_input_size(model_name), TILE_OVERLAP]
+    else:
+        variant = max_size = max_input_size(model_name) if downscale else None
+    if preprocess:
+        variant = [variant, preprocess.as_dict()]
+
+    key = None
+    if cacheable:
+        with metrics.phase("cache_lookup"):
+            key = cache_key(digest_file(image_file), model_name, preset, custom_prompt, noise_level,
+                            scientific_mode, variant=variant)
+            cached = results.get(key)
+        if cached is not None:
+            metrics.registry.inc("result_cache_hits_total")
+            return {**cached, "upload": None}
+        metrics.registry.inc("result_cache_misses_total")
+
+        # Identical runs already in flight (another session, another tab) are
+        # joined rather than repeated; only the first one uploads
+        def run():
+            # The run we missed in the cache may have finished just before we got here
+            cached = results.get(key)
+            if cached is not None:
+                return {**cached, "upload": None}
+            return _run(image_file, filename, model_name, preset, custom_prompt, noise_level, scientific_mode,
+                        max_size, tiled, base_url, preprocess, key)
+
+        result, shared = inflight.do(key, run)
+        if shared:
+            metrics.registry.inc("coalesced_requests_total")
+            return {**result, "upload": None}
+        return result
+
+    return _run(image_file, filename, model_name, preset, custom_prompt, noise_level, scientific_mode,
+                max_size, tiled, base_url, preprocess, key)
+
+
+def _run(image_file, filename, model_name, preset, custom_prompt, noise_level, scientific_mode, max_size,
+         tiled, base_url, preprocess, key):
+    """One backend run (or tiled set of runs), stored in the cache under key when it is not None"""
+    if preprocess:
+        image_file.seek(0)
+        with metrics.phase("preprocess") as timing:
+            processed = preprocess.apply(image_file.read())
+            timing["bytes"] = len(processed)
+        image_file = io.BytesIO(processed)
+
+    # Create the form data
+    data = {
+        "model_name": model_name,
+        "preset": preset,
+        "noise_level": noise_level,
+        "scientific_mode": str(scientific_mode).lower()
+    }
+
+    # Add custom prompt if it exists
+    if custom_prompt:
+        data["custom_prompt"] = custom_prompt
+
+    if tiled:
+        result = enhance_tiled(image_file, data, max_input_size(model_name), base_url)
+        if key is not None:
+            results.put(key, result)
+        image_file.seek(0, io.SEEK_END)
+        size = result["source_size"]
+        return {**result, "upload": {"original_bytes": image_file.tell(), "sent_bytes": result["sent_bytes"],
+                                     "original_size": size, "sent_size": size, "tiles": result["tiles"]}}
+
+    image_file.seek(0)
+    with metrics.phase("prepare") as timing:
+        # Only images that must shrink or change format are decoded and read into memory
+        upload = stream_upload(image_file, filename, max_size)
+        if upload is None:
+            upload = prepare_upload(image_file.read(), filename, max_size)
+        timing["bytes"] = upload.sent_bytes
+    result = backends.enhance_image(upload.open(), upload.filename, upload.mime_type, data, base_url,
+                                    progress=upload_reporter())
+    if key is not None:
+        with metrics.phase("cache_store"):
+            results.put(key, result)
+    return {**result, "upload": upload.stats()}
@@ -0,0 +1,110 @@
+"""Deep-zoom tile pyramids for the magnifier
+
+The magnifier used to set the whole enhanced image as the CSS background of
+the glass, so the browser held the full decoded upscale and repainted it on
+every mouse move. Instead each result is cut once into a pyramid of small
+tiles: level 0 is full resolution and every level above halves it, up to one
+that fits in a single tile. The glass then loads only the few tiles under the
+cursor, from the level that matches its zoom.
+
+Pyramids are written under PYRAMID_DIR/<content key>/ as
+<level>/<column>_<row>.<ext> plus an info.json manifest, and shared by all
+sessions showing the same result.
+"""
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from PIL import Image
+
+from . import config, metrics
+from .rendering import content_key
+
+EXTENSIONS = {"WEBP": "webp", "JPEG": "jpg", "PNG": "png"}
+
+
+def build_pyramid(data, path, tile_size=config.PYRAMID_TILE_SIZE, fmt=config.PREVIEW_FORMAT,
+                  quality=config.PREVIEW_QUALITY):
+    """Write the tiles and manifest of encoded image bytes into the directory path"""
+    image = Image.open(io.BytesIO(data))
+    if image.mode not in ("RGB", "RGBA", "L"):
+        image = image.convert("RGB")
+    if fmt == "JPEG" and image.mode == "RGBA":
+        image = image.convert("RGB")
+    ext = EXTENSIONS[fmt]
+
+    levels = []
+    level = 0
+    while True:
+        levels.append(list(image.size))
+        os.makedirs(os.path.join(path, str(level)))
+        for top in range(0, image.height, tile_size):
+            for left in range(0, image.width, tile_size):
+                tile = image.crop((left, top, min(left + tile_size, image.width), min(top + tile_size, image.height)))
+                tile.save(os.path.join(path, str(level), f"{left // tile_size}_{top // tile_size}.{ext}"),
+                          format=fmt, quality=quality)
+        if max(image.size) <= tile_size:
+            break
+        # Halving by box filter is exact and much cheaper than a resample
+        image = image.reduce(2)
+        level += 1
+
+    manifest = {"width": levels[0][0], "height": levels[0][1], "tile_size": tile_size,
+                "levels": levels, "ext": ext}
+    with open(os.path.join(path, "info.json"), "w") as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+class PyramidCache:
+    """Pyramids on disk, built on first request and evicted oldest first"""
+
+    def __init__(self, root=config.PYRAMID_DIR, url=config.PYRAMID_URL, max_items=config.PYRAMID_MAX_ITEMS):
+        self.root = root
+        self.url = url
+        self.max_items = max_items
+        self._lock = threading.Lock()
+
+    def get(self, image):
+        """Manifest of the pyramid for image (bytes or a StoredImage), with its base URL"""
+        key = content_key(image)
+        path = os.path.join(self.root, key)
+        info = os.path.join(path, "info.json")
+        if os.path.exists(info):
+            # Directory mtime doubles as last-used time for eviction
+            os.utime(path)
+        else:
+            with self._lock:
+                if not os.path.exists(info):
+                    self._build(getattr(image, "data", image), path)
+        with open(info) as f:
+            manifest = json.load(f)
+        manifest["url"] = f"{self.url}/{key}"
+        return manifest
+
+    def _build(self, data, path):
+        os.makedirs(self.root, exist_ok=True)
+        # Built aside and renamed into place, so readers never see half a pyramid
+        tmp = tempfile.mkdtemp(dir=self.root, prefix=".build-")
+        try:
+            with metrics.phase("pyramid") as timing:
+                build_pyramid(data, os.path.join(tmp, "tiles"))
+                timing["bytes"] = len(data)
+            os.rename(os.path.join(tmp, "tiles"), path)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        metrics.registry.inc("pyramids_built_total")
+        self._evict()
+
+    def _evict(self):
+        entries = [e for e in os.scandir(self.root) if e.is_dir() and not e.name.startswith(".")]
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:max(len(entries) - self.max_items, 0)]:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+# Shared by every Streamlit session in this process
+pyramids = PyramidCache()
@@ -0,0 +1,156 @@
+"""Per-session cache of encoded images for display and download
+
+Every widget that shows or offers an image used to re-encode it to PNG and
+base64 on every rerun. A RenderCache encodes each distinct image once and
+hands the same bytes and data URL to every widget that asks.
+
+Inline images are display-sized previews; only the download button gets the
+full-resolution encoding. Images may be given as bytes or as StoredImage
+handles (see session_store.py), whose bytes are only read on a cache miss.
+"""
+import base64
+import hashlib
+import io
+import re
+import time
+from collections import OrderedDict
+
+from PIL import Image, ImageFilter
+
+from . import config, metrics
+from .processing import from_array, to_array
+
+MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp", "GIF": "image/gif"}
+
+
+def content_key(data):
+    """Digest identifying encoded image bytes (precomputed for stored images)"""
+    key = getattr(data, "key", None)
+    return key if key is not None else hashlib.sha256(data).hexdigest()
+
+
+def _bytes(data):
+    # A StoredImage may have to read its bytes back from disk
+    return getattr(data, "data", data)
+
+
+class Rendition:
+    """Encoded image bytes plus the data URL built from them on first use"""
+
+    def __init__(self, data, mime):
+        self.data = data
+        self.mime = mime
+        self.seconds = 0.0
+        self._data_url = None
+
+    @property
+    def data_url(self):
+        if self._data_url is None:
+            self._data_url = f"data:{self.mime};base64,{base64.b64encode(self.data).decode()}"
+        return self._data_url
+
+
+def encode(data, fmt):
+    """Rendition of encoded image bytes in fmt, reusing the bytes when already in fmt"""
+    image = Image.open(io.BytesIO(data))
+    if image.format == fmt:
+        return Rendition(bytes(data), MIME_TYPES[fmt])
+    buffered = io.BytesIO()
+    image.save(buffered, format=fmt)
+    return Rendition(buffered.getvalue(), MIME_TYPES[fmt])
+
+
+def _displayable(image, fmt):
+    """Convert modes the preview encoders cannot write (16-bit, float, palette)"""
+    if image.mode in ("I;16", "I;16B", "I;16L"):
+        image = image.convert("I")
+    if image.mode in ("I", "F"):
+        return image.point(lambda v: v * (1 / 256)).convert("L")
+    if image.mode == "RGBA" and fmt != "JPEG":
+        return image
+    if image.mode not in ("RGB", "L"):
+        return image.convert("RGB")
+    return image
+
+
+def resize(data, max_size, fmt=config.PREVIEW_FORMAT, quality=config.PREVIEW_QUALITY):
+    """Rendition no larger than max_size on its longest edge, lossily encoded"""
+    image = Image.open(io.BytesIO(data))
+    # Lets the JPEG decoder skip straight to a reduced scale
+    image.draft("RGB", (max_size, max_size))
+    image = _displayable(image, fmt)
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+    buffered = io.BytesIO()
+    image.save(buffered, format=fmt, quality=quality)
+    return Rendition(buffered.getvalue(), MIME_TYPES[fmt])
+
+
+def model_scale(model_name):
+    """Upscaling factor advertised in a model name like "SwinIR (4x)", else 1"""
+    match = re.search(r"(\d+)x\)", model_name or "")
+    return int(match.group(1)) if match else 1
+
+
+def quick_enhance(data, model_name, noise_level, scientific_mode=False, preprocess=None,
+                  max_size=config.PREVIEW_MAX_SIZE, fmt=config.PREVIEW_FORMAT, quality=config.PREVIEW_QUALITY):
+    """Classical stand-in for the backend result, at preview size
+
+    A Lanczos resize to what the model's output would look like at column
+    width, the local preprocessing, then an unsharp mask whose strength
+    follows the noise level (halved in scientific mode, which adds nothing).
+    """
+    image = Image.open(io.BytesIO(data))
+    image.draft("RGB", (max_size, max_size))
+    image = _displayable(image, "JPEG")
+    scale = min(model_scale(model_name), max_size / max(image.size))
+    image = image.resize((max(round(image.width * scale), 1), max(round(image.height * scale), 1)), Image.LANCZOS)
+    if preprocess:
+        image = from_array(preprocess.apply_array(to_array(image)))
+    percent = 60 + noise_level * 4
+    if scientific_mode:
+        percent /= 2
+    image = image.filter(ImageFilter.UnsharpMask(radius=2, percent=int(percent), threshold=2))
+    buffered = io.BytesIO()
+    image.save(buffered, format=fmt, quality=quality)
+    return Rendition(buffered.getvalue(), MIME_TYPES[fmt])
+
+
+class RenderCache:
+    """Small LRU of renditions, keyed on image content and target format"""
+
+    def __init__(self, max_items=config.RENDER_CACHE_ITEMS):
+        self.max_items = max_items
+        self._items = OrderedDict()
+
+    def get(self, key, render):
+        """Cached rendition for key, calling render() to build it on a miss"""
+        rendition = self._items.get(key)
+        if rendition is None:
+            with metrics.phase("render") as timing:
+                start = time.perf_counter()
+                rendition = self._items[key] = render()
+                rendition.seconds = time.perf_counter() - start
+                timing["bytes"] = len(rendition.data)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        else:
+            self._items.move_to_end(key)
+        return rendition
+
+    def preview(self, data, max_size=config.PREVIEW_MAX_SIZE):
+        """Display-sized rendition for column-width images"""
+        return self.get((content_key(data), "preview", max_size), lambda: resize(_bytes(data), max_size))
+
+    def quick_preview(self, data, model_name, noise_level, scientific_mode=False, preprocess=None):
+        """Instant local approximation of the enhanced image, for the current settings"""
+        key = (content_key(data), "quick", model_name, noise_level, scientific_mode,
+               preprocess.key() if preprocess else None)
+        return self.get(key, lambda: quick_enhance(_bytes(data), model_name, noise_level, scientific_mode,
+                                                   preprocess))
+
+    def encoded(self, data, fmt="PNG"):
+        """Rendition in a specific format, e.g. PNG for the download button"""
+        if getattr(data, "format", None) == fmt:
+            # Already in fmt: caching it would pin a spilled image in memory
+            return Rendition(data.data, MIME_TYPES[fmt])
+        return self.get((content_key(data), fmt), lambda: encode(_bytes(data), fmt))
@@ -0,0 +1,281 @@
+"""Content-addressed cache of enhancement results
+
+Results are keyed on a digest of the uploaded bytes plus every parameter sent
+to /enhance_image, so the same image with the same settings never reaches the
+GPU twice. A small in-memory LRU sits in front of a size-bounded disk tier.
+Identical requests that arrive while the first is still running (everybody in
+a class uploading the same sample image) wait for that run instead of
+starting their own; see SingleFlight.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from . import config
+
+CHUNK_SIZE = 1 << 20
+
+
+def digest_file(fileobj):
+    """SHA-256 of a file-like object's contents, leaving its position unchanged"""
+    h = hashlib.sha256()
+    start = fileobj.tell()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+        h.update(chunk)
+    fileobj.seek(start)
+    return h.hexdigest()
+
+
+def cache_key(image_digest, model_name, preset, custom_prompt, noise_level, scientific_mode, variant=None):
+    """Stable key for one image and one set of enhancement parameters
+
+    variant distinguishes client-side processing that changes what is sent,
+    e.g. the size an upload was downscaled to.
+    """
+    params = json.dumps(
+        [image_digest, model_name, preset, custom_prompt or None, float(noise_level), bool(scientific_mode), variant],
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(params.encode()).hexdigest()
+
+
+class MemoryLRU:
+    """LRU bounded by both entry count and total payload bytes"""
+
+    def __init__(self, max_items, max_bytes):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._bytes -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self._bytes += size
+            while len(self._items) > self.max_items or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._bytes -= evicted
+
+
+def pack(value):
+    """Serialise a result dict, storing bytes values as raw blobs after a JSON header"""
+    blobs = []
+
+    def strip(v):
+        if isinstance(v, (bytes, bytearray, memoryview)):
+            blobs.append(bytes(v))
+            return {"$blob": len(blobs) - 1}
+        if isinstance(v, dict):
+            return {k: strip(x) for k, x in v.items()}
+        if isinstance(v, (list, tuple)):
+            return [strip(x) for x in v]
+        return v
+
+    stripped = strip(value)
+    header = json.dumps({"value": stripped, "sizes": [len(b) for b in blobs]}).encode()
+    return b"".join([len(header).to_bytes(4, "big"), header, *blobs])
+
+
+def unpack(data):
+    """Inverse of pack()"""
+    header_len = int.from_bytes(data[:4], "big")
+    header = json.loads(data[4:4 + header_len])
+    blobs = []
+    pos = 4 + header_len
+    for size in header["sizes"]:
+        blobs.append(data[pos:pos + size])
+        pos += size
+
+    def restore(v):
+        if isinstance(v, dict):
+            if set(v) == {"$blob"}:
+                return blobs[v["$blob"]]
+            return {k: restore(x) for k, x in v.items()}
+        if isinstance(v, list):
+            return [restore(x) for x in v]
+        return v
+
+    return restore(header["value"])
+
+
+class DiskCache:
+    """Directory of packed results, evicting least recently used files over max_bytes"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._bytes = None
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.bin")
+
+    def _entries(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".bin"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, st.st_size, st.st_mtime
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Bump mtime so eviction treats this entry as recently used
+            os.utime(path)
+        except (FileNotFoundError, OSError):
+            return None
+        try:
+            return unpack(data)
+        except (ValueError, KeyError, IndexError):
+            return None
+
+    def put(self, key, value):
+        data = pack(value)
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(size for _, size, _ in self._entries())
+            elif os.path.exists(path):
+                self._bytes -= os.path.getsize(path)
+            os.replace(tmp, path)
+            self._bytes += len(data)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        self._bytes = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self._bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._bytes -= size
+
+
+class ResultCache:
+    """Two-tier (memory, then disk) cache of decoded /enhance_image results"""
+
+    def __init__(self, directory=config.RESULT_CACHE_DIR,
+                 memory_items=config.RESULT_CACHE_MEMORY_ITEMS,
+                 memory_mb=config.RESULT_CACHE_MEMORY_MB,
+                 disk_mb=config.RESULT_CACHE_DISK_MB):
+        self.memory = MemoryLRU(memory_items, memory_mb << 20)
+        self.disk = DiskCache(directory, disk_mb << 20)
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        value = self.disk.get(key)
+        if value is not None:
+            self.memory.put(key, value, _size(value))
+        return value
+
+    def put(self, key, value):
+        self.memory.put(key, value, _size(value))
+        try:
+            self.disk.put(key, value)
+        except OSError:
+            # A full or read-only disk only costs us the second tier
+            pass
+
+
+def _size(value):
+    return sum(len(v) for v in _payloads(value))
+
+
+def _payloads(value):
+    if isinstance(value, (str, bytes)):
+        yield value
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from _payloads(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            yield from _payloads(v)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """At most one call per key at a time; callers arriving meanwhile share its outcome"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Return (fn(), shared), running fn only if no call with this key is in flight
+
+        shared is True for callers that waited on another caller's run. They
+        get the same result, or the same exception raised again.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        """Number of distinct calls running and callers waiting on them"""
+        with self._lock:
+            return len(self._calls), sum(call.waiters for call in self._calls.values())
+
+
+# Shared by every Streamlit session in this process
+results = ResultCache()
+inflight = SingleFlight()
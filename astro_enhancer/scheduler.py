@@ -0,0 +1,197 @@
+"""Fair-share, priority scheduling of enhancement work across sessions
+
+First come, first served let one session with a batch or a burst of re-runs
+hold every slot while everybody else waited. Waiting work is now served:
+
+* by priority: INTERACTIVE before STANDARD before BULK, so a quick
+  single-image run overtakes a long diffusion run or a batch
+* round-robin across owners (Streamlit sessions) within a priority
+* skipping owners already using their quota of concurrent slots (even for
+  lower-priority work of other owners), unless everybody waiting is at
+  quota, so a heavy user still gets otherwise idle capacity
+
+The same policy orders the job queue (jobs.py) and the slots in front of
+/enhance_image (client.py). Work learns its owner and priority, and whether
+it runs in a background job, from the thread it runs on; see acting_as().
+"""
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+
+from . import config, metrics
+
+INTERACTIVE = 0
+STANDARD = 1
+BULK = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", STANDARD: "standard", BULK: "bulk"}
+
+_identity = threading.local()
+
+
+def identity():
+    """(owner, priority) of the work running on this thread"""
+    return getattr(_identity, "owner", None), getattr(_identity, "priority", STANDARD)
+
+
+def in_background():
+    """Whether the work running on this thread belongs to a background job, which nobody blocks on"""
+    return getattr(_identity, "background", False)
+
+
+@contextmanager
+def acting_as(owner, priority=STANDARD, background=False):
+    """Schedule work done on this thread as owner's, at priority, and as part of a background job if background"""
+    previous = identity(), in_background()
+    _identity.owner, _identity.priority = owner, priority
+    _identity.background = background
+    try:
+        yield
+    finally:
+        (_identity.owner, _identity.priority), _identity.background = previous
+
+
+class FairQueue:
+    """Waiting items by priority, then round-robin across owners, within a per-owner quota
+
+    Not thread-safe; callers hold their own lock. pop() counts the item's
+    owner as running until done() is called for it.
+    """
+
+    def __init__(self, quota=config.SESSION_QUOTA):
+        self.quota = quota
+        # priority -> owner -> items, owners in round-robin order
+        self._levels = {}
+        self._running = Counter()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def push(self, item, owner=None, priority=STANDARD):
+        self._levels.setdefault(priority, OrderedDict()).setdefault(owner, deque()).append(item)
+        self._size += 1
+
+    def remove(self, item):
+        """Drop an item that is still waiting; False if it was not found"""
+        for owners in self._levels.values():
+            for owner, items in owners.items():
+                if item in items:
+                    items.remove(item)
+                    if not items:
+                        del owners[owner]
+                    self._size -= 1
+                    return True
+        return False
+
+    def _next(self, levels, running):
+        """(owners, owner) to serve next, given running counts per owner"""
+        first = (None, None)
+        for priority in sorted(levels):
+            owners = levels[priority]
+            for owner in owners:
+                if running[owner] < self.quota:
+                    return owners, owner
+                if first[0] is None:
+                    first = owners, owner
+        # Everybody waiting is at quota: capacity would otherwise sit idle
+        return first
+
+    def _take(self, owners, owner, running):
+        items = owners[owner]
+        item = items.popleft()
+        # Rotate: this owner goes to the back of its priority's round
+        del owners[owner]
+        if items:
+            owners[owner] = items
+        running[owner] += 1
+        return item
+
+    def pop(self):
+        """The next item to serve, or None when nothing is waiting"""
+        owners, owner = self._next(self._levels, self._running)
+        if owners is None:
+            return None
+        self._size -= 1
+        return self._take(owners, owner, self._running)
+
+    def done(self, owner):
+        """An item popped for owner has finished"""
+        self._running[owner] -= 1
+        if self._running[owner] <= 0:
+            del self._running[owner]
+
+    def order(self):
+        """Waiting items in the order they would be served if none finished meanwhile"""
+        levels = {p: OrderedDict((o, deque(items)) for o, items in owners.items())
+                  for p, owners in self._levels.items()}
+        running = Counter(self._running)
+        served = []
+        while True:
+            owners, owner = self._next(levels, running)
+            if owners is None:
+                return served
+            served.append(self._take(owners, owner, running))
+
+    def depth(self):
+        """Number of waiting items per priority"""
+        return {p: sum(len(items) for items in owners.values()) for p, owners in self._levels.items() if owners}
+
+    def owners(self):
+        """Owners with waiting items"""
+        return {owner for owners in self._levels.values() for owner in owners}
+
+
+class _Ticket:
+    def __init__(self, owner):
+        self.owner = owner
+        self.granted = False
+
+
+class FairGate:
+    """Semaphore whose waiters are admitted by a FairQueue instead of in arrival order"""
+
+    def __init__(self, capacity, quota=config.SESSION_QUOTA, name="enhance"):
+        self.capacity = capacity
+        self.name = name
+        self._free = capacity
+        self._queue = FairQueue(quota)
+        self._cond = threading.Condition()
+
+    def _admit(self):
+        while self._free > 0:
+            ticket = self._queue.pop()
+            if ticket is None:
+                break
+            ticket.granted = True
+            self._free -= 1
+        metrics.registry.set(f"{self.name}_queue_depth", len(self._queue))
+        self._cond.notify_all()
+
+    def acquire(self, timeout=None):
+        """Wait for a slot as this thread's owner and priority; the ticket to release, or None on timeout"""
+        owner, priority = identity()
+        ticket = _Ticket(owner)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._queue.push(ticket, owner, priority)
+            self._admit()
+            while not ticket.granted:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._queue.remove(ticket)
+                    metrics.registry.set(f"{self.name}_queue_depth", len(self._queue))
+                    return None
+                self._cond.wait(remaining)
+        return ticket
+
+    def release(self, ticket):
+        with self._cond:
+            self._queue.done(ticket.owner)
+            self._free += 1
+            self._admit()
+
+    def waiting(self):
+        """Number of callers waiting for a slot"""
+        with self._cond:
+            return len(self._queue)
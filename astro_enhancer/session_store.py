@@ -0,0 +1,177 @@
+"""Memory budget for result images held by Streamlit sessions
+
+Every session keeps its latest result between reruns, and with many users
+holding 4x upscales the server runs out of memory. Sessions hold StoredImage
+handles instead of bytes: the encoded image stays in memory while its session
+and the whole process are within budget, otherwise the least recently used
+images are spilled to files and read back the next time they are needed.
+Usage is published as metrics for operators.
+"""
+import hashlib
+import io
+import itertools
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+from PIL import Image
+
+from . import config, metrics
+
+
+def _format(data):
+    try:
+        return Image.open(io.BytesIO(data)).format
+    except Exception:
+        return None
+
+
+class StoredImage:
+    """Encoded image bytes, in memory or spilled to a file"""
+
+    def __init__(self, store, owner, data, path):
+        self.owner = owner
+        self.path = path
+        self.key = hashlib.sha256(data).hexdigest()
+        self.size = len(data)
+        self.format = _format(data)
+        self.on_disk = False
+        self._store = store
+        self._data = data
+
+    @property
+    def spilled(self):
+        return self._data is None
+
+    @property
+    def data(self):
+        """The encoded bytes, read back from disk if they were spilled"""
+        if self._data is None:
+            return self._store.load(self)
+        self._store.touch(self)
+        return self._data
+
+    def __len__(self):
+        return self.size
+
+
+class ImageStore:
+    """Per-session and global budgets over StoredImages, with LRU spilling"""
+
+    def __init__(self, memory_mb=config.SESSION_STORE_MEMORY_MB, session_mb=config.SESSION_MEMORY_MB,
+                 spill_dir=config.SESSION_SPILL_DIR):
+        self.memory_limit = memory_mb * 1024 * 1024
+        self.session_limit = session_mb * 1024 * 1024
+        self.spill_dir = spill_dir
+        self._dir = None
+        # id -> weak reference, least recently used first
+        self._resident = OrderedDict()
+        self._usage = {}
+        self._spilled = {}
+        self.resident_bytes = 0
+        self.spilled_bytes = 0
+        self._names = itertools.count()
+        self._lock = threading.RLock()
+
+    def put(self, owner, data):
+        """Keep data on behalf of owner (a session id) and return its handle"""
+        with self._lock:
+            if self._dir is None:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                # One directory per process, so restarts never see stale files
+                self._dir = tempfile.mkdtemp(dir=self.spill_dir)
+            path = os.path.join(self._dir, f"{next(self._names)}.bin")
+        item = StoredImage(self, owner, data, path)
+        weakref.finalize(item, self._forget, id(item), owner, item.size, path)
+        with self._lock:
+            self._admit(item)
+            self._enforce(owner)
+        return item
+
+    def usage(self, owner=None):
+        """(bytes in memory, bytes spilled) for one session, or for the process"""
+        with self._lock:
+            if owner is None:
+                return self.resident_bytes, self.spilled_bytes
+            return self._usage.get(owner, 0), self._spilled.get(owner, 0)
+
+    def touch(self, item):
+        with self._lock:
+            if id(item) in self._resident:
+                self._resident.move_to_end(id(item))
+
+    def load(self, item):
+        """Read a spilled image back into memory"""
+        with open(item.path, "rb") as f:
+            data = f.read()
+        metrics.registry.inc("session_images_reloads_total")
+        with self._lock:
+            if item._data is None:
+                item._data = data
+                self._admit(item)
+                self._enforce(item.owner)
+        return data
+
+    def _admit(self, item):
+        self._resident[id(item)] = weakref.ref(item)
+        self._usage[item.owner] = self._usage.get(item.owner, 0) + item.size
+        self.resident_bytes += item.size
+
+    def _enforce(self, owner):
+        while self._usage.get(owner, 0) > self.session_limit and self._spill_one(owner):
+            pass
+        while self.resident_bytes > self.memory_limit and self._spill_one():
+            pass
+        self._publish()
+
+    def _spill_one(self, owner=None):
+        """Spill the least recently used resident image (of owner, if given)"""
+        for key, ref in self._resident.items():
+            item = ref()
+            if item is not None and (owner is None or item.owner == owner):
+                break
+        else:
+            return False
+        if not item.on_disk:
+            tmp = item.path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(item._data)
+            os.replace(tmp, item.path)
+            item.on_disk = True
+            self.spilled_bytes += item.size
+            self._spilled[item.owner] = self._spilled.get(item.owner, 0) + item.size
+        del self._resident[key]
+        item._data = None
+        self._release(item.owner, item.size)
+        metrics.registry.inc("session_images_spills_total")
+        return True
+
+    def _release(self, owner, size):
+        self._usage[owner] -= size
+        self.resident_bytes -= size
+        if not self._usage[owner]:
+            del self._usage[owner]
+
+    def _forget(self, key, owner, size, path):
+        # Runs when a session drops its handle, e.g. on a new result or when the session ends
+        with self._lock:
+            if self._resident.pop(key, None) is not None:
+                self._release(owner, size)
+            if os.path.exists(path):
+                os.remove(path)
+                self.spilled_bytes -= size
+                self._spilled[owner] -= size
+                if not self._spilled[owner]:
+                    del self._spilled[owner]
+            self._publish()
+
+    def _publish(self):
+        metrics.registry.set("session_images_resident_bytes", self.resident_bytes)
+        metrics.registry.set("session_images_spilled_bytes", self.spilled_bytes)
+        metrics.registry.set("session_images_sessions", len(self._usage))
+
+
+# Shared by every Streamlit session in this process
+images = ImageStore()
@@ -0,0 +1,133 @@
+"""Tiled enhancement of images too large for the upscalers to take in one pass
+
+The image is cut into overlapping tiles no bigger than the model's maximum
+input, the tiles are enhanced concurrently, and the results are feathered
+together on a single output canvas. Tiles are pasted in raster order, so the
+left and top neighbours of a tile are always on the canvas already and only
+a bounded window of tiles is ever held in memory.
+"""
+import io
+import math
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageChops
+
+from . import backends, config, metrics, scheduler
+
+
+def plan_tiles(width, height, tile_size, overlap):
+    """Row-major list of (left, top, right, bottom) boxes covering the image
+
+    Tiles are spread evenly, so neighbours overlap by at least `overlap`
+    pixels and the last tile sits flush with the edge.
+    """
+    step = max(tile_size - overlap, 1)
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        count = math.ceil((length - overlap) / step)
+        return [round(i * (length - tile_size) / (count - 1)) for i in range(count)]
+
+    return [
+        (left, top, min(left + tile_size, width), min(top + tile_size, height))
+        for top in starts(height)
+        for left in starts(width)
+    ]
+
+
+def _ramp(length, size, horizontal):
+    """L-mode mask fading from 0 to 255 over the first `length` pixels"""
+    gradient = Image.linear_gradient("L")
+    if horizontal:
+        ramp = gradient.rotate(90).resize((length, size[1]))
+    else:
+        ramp = gradient.resize((size[0], length))
+    mask = Image.new("L", size, 255)
+    mask.paste(ramp, (0, 0))
+    return mask
+
+
+def _feather_mask(size, blend_left, blend_top):
+    """Mask that blends a tile into what is already left of and above it"""
+    mask = None
+    if blend_left:
+        mask = _ramp(min(blend_left, size[0]), size, horizontal=True)
+    if blend_top:
+        top = _ramp(min(blend_top, size[1]), size, horizontal=False)
+        mask = top if mask is None else ImageChops.multiply(mask, top)
+    return mask
+
+
+def _enhance_tile(base_url, image, box, data, trace, identity):
+    # Tile threads record into the trace, and are scheduled as the owner, of the run they belong to
+    with metrics.use_trace(trace), scheduler.acting_as(*identity):
+        with metrics.phase("tile_encode") as timing:
+            buffered = io.BytesIO()
+            image.crop(box).save(buffered, format="PNG")
+            sent = timing["bytes"] = buffered.tell()
+        buffered.seek(0)
+        return backends.enhance_image(buffered, "tile.png", "image/png", data, base_url), sent
+
+
+def enhance_tiled(image_file, data, tile_size, base_url, overlap=config.TILE_OVERLAP,
+                  workers=config.TILE_WORKERS):
+    """Enhance an image tile by tile
+
+    Returns a result like client.enhance_image, plus the number of tiles, the
+    total bytes uploaded for them and the size of the source image.
+    """
+    image_file.seek(0)
+    image = Image.open(image_file)
+    image.load()
+    boxes = plan_tiles(image.width, image.height, tile_size, overlap)
+
+    trace = metrics.current_trace()
+    identity = scheduler.identity() + (scheduler.in_background(),)
+    canvas = None
+    scale = None
+    prompt_used = None
+    sent_bytes = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tile") as pool:
+        pending = deque()
+        queued = iter(boxes)
+        # Keep a bounded window of tiles in flight, consumed in raster order
+        for box in queued:
+            pending.append((box, pool.submit(_enhance_tile, base_url, image, box, data, trace, identity)))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            box, future = pending.popleft()
+            next_box = next(queued, None)
+            if next_box is not None:
+                pending.append((next_box, pool.submit(_enhance_tile, base_url, image, next_box, data, trace, identity)))
+
+            result, sent = future.result()
+            sent_bytes += sent
+            prompt_used = prompt_used or result.get("prompt_used")
+            stitch_start = time.perf_counter()
+            tile = Image.open(io.BytesIO(result["enhanced_image"]))
+            if canvas is None:
+                scale = tile.width / (box[2] - box[0])
+                canvas = Image.new(tile.mode, (round(image.width * scale), round(image.height * scale)))
+            target = tuple(round(v * scale) for v in box)
+            tile_size_out = (target[2] - target[0], target[3] - target[1])
+            if tile.size != tile_size_out:
+                tile = tile.resize(tile_size_out, Image.LANCZOS)
+            if tile.mode != canvas.mode:
+                tile = tile.convert(canvas.mode)
+
+            blend_left = round(overlap * scale) if box[0] > 0 else 0
+            blend_top = round(overlap * scale) if box[1] > 0 else 0
+            canvas.paste(tile, target[:2], _feather_mask(tile.size, blend_left, blend_top))
+            metrics.record("stitch", time.perf_counter() - stitch_start)
+            del tile, result
+
+    with metrics.phase("encode") as timing:
+        buffered = io.BytesIO()
+        canvas.save(buffered, format="PNG")
+        timing["bytes"] = buffered.tell()
+    return {"enhanced_image": buffered.getvalue(), "prompt_used": prompt_used, "before_after": [],
+            "tiles": len(boxes), "sent_bytes": sent_bytes, "source_size": list(image.size)}
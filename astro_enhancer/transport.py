@@ -0,0 +1,173 @@
+"""Encoding of /enhance_image requests and decoding of their responses
+
+Requests are sent as a streamed multipart/form-data body (MultipartBody), so
+the image is read from its file in chunks as it goes out.
+
+The backend may answer in one of three shapes, tried in this order:
+
+* multipart/mixed: a JSON "metadata" part plus one binary part per image
+* JSON with a "result_id" and no inline images: the images are then fetched
+  as raw bytes from /results/<id>/... by the client
+* JSON with base64 strings (the original format), kept as a fallback
+
+Whatever the shape, callers get a dict of the form
+{"enhanced_image": bytes, "before_after": [bytes, ...], "prompt_used": str}.
+The client asks for no before_after images, so that list is usually empty.
+"""
+import base64
+import io
+import json
+import uuid
+
+CHUNK_SIZE = 1 << 16
+
+# Advertised to the backend; JSON is still accepted from servers that ignore it
+ACCEPT = "multipart/mixed, application/json;q=0.5"
+
+
+class MultipartBody:
+    """A multipart/form-data body that reads its file part lazily
+
+    requests builds files= bodies in memory, which for a large image means a
+    second full copy per upload. This object has a length, so it is sent with
+    a Content-Length header, and the connection pulls it through read() a
+    block at a time. progress(sent, total) is called as bytes go out.
+    """
+
+    def __init__(self, fields, name, filename, fileobj, mime_type, progress=None):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        head = io.BytesIO()
+        for key, value in fields.items():
+            head.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n'.encode())
+            head.write(f"{value}\r\n".encode())
+        filename = filename.replace('"', "%22")
+        head.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                   f"Content-Type: {mime_type}\r\n\r\n".encode())
+        self._head = head.getvalue()
+        self._tail = f"\r\n--{boundary}--\r\n".encode()
+
+        self._file = fileobj
+        self._start = fileobj.tell()
+        fileobj.seek(0, io.SEEK_END)
+        self.file_size = fileobj.tell() - self._start
+        fileobj.seek(self._start)
+
+        self.total = len(self._head) + self.file_size + len(self._tail)
+        self.sent = 0
+        self.progress = progress
+
+    def __len__(self):
+        return self.total
+
+    def __iter__(self):
+        return iter(lambda: self.read(CHUNK_SIZE), b"")
+
+    def rewind(self):
+        """Start over, e.g. before a retry"""
+        self._file.seek(self._start)
+        self.sent = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b"".join(self)
+        file_end = len(self._head) + self.file_size
+        if self.sent < len(self._head):
+            chunk = self._head[self.sent:self.sent + size]
+        elif self.sent < file_end:
+            chunk = self._file.read(min(size, file_end - self.sent))
+            if not chunk:
+                raise IOError("Upload file shrank while it was being sent")
+        else:
+            offset = self.sent - file_end
+            chunk = self._tail[offset:offset + size]
+        self.sent += len(chunk)
+        if self.progress is not None and chunk:
+            self.progress(self.sent, self.total)
+        return chunk
+
+
+def read_body(response):
+    """Read a streamed response body into one buffer, without intermediate copies"""
+    buffer = io.BytesIO()
+    for chunk in response.iter_content(CHUNK_SIZE):
+        buffer.write(chunk)
+    # getvalue() hands over the buffer itself while nothing else references it
+    return buffer.getvalue()
+
+
+def decode_base64_image(value):
+    """Bytes of a base64 image string, with or without a data URL prefix"""
+    if "base64," in value:
+        value = value.split("base64,", 1)[1]
+    return base64.b64decode(value)
+
+
+def _header_params(value):
+    """Split a header like 'form-data; name="x"' into (main, {param: value})"""
+    main, *params = [p.strip() for p in value.split(";")]
+    parsed = {}
+    for param in params:
+        if "=" in param:
+            k, v = param.split("=", 1)
+            parsed[k.strip().lower()] = v.strip().strip('"')
+    return main.lower(), parsed
+
+
+def iter_multipart(content_type, body):
+    """Yield (headers, payload) for each part of a multipart body"""
+    _, params = _header_params(content_type)
+    boundary = params.get("boundary")
+    if not boundary:
+        raise ValueError("multipart response without a boundary")
+    delimiter = b"--" + boundary.encode()
+    data = bytes(body)
+
+    pos = data.find(delimiter)
+    while pos != -1:
+        pos += len(delimiter)
+        if data.startswith(b"--", pos):
+            return
+        header_end = data.find(b"\r\n\r\n", pos)
+        if header_end == -1:
+            raise ValueError("truncated multipart response")
+        headers = {}
+        for line in data[pos:header_end].decode("latin-1").split("\r\n"):
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        next_pos = data.find(b"\r\n" + delimiter, header_end)
+        if next_pos == -1:
+            raise ValueError("truncated multipart response")
+        yield headers, data[header_end + 4:next_pos]
+        pos = next_pos + 2
+
+
+def parse_multipart(content_type, body):
+    """Build a result dict from a multipart/mixed response"""
+    result = {"enhanced_image": None, "before_after": [], "prompt_used": None}
+    for headers, payload in iter_multipart(content_type, body):
+        _, disposition = _header_params(headers.get("content-disposition", ""))
+        name = disposition.get("name", "")
+        if headers.get("content-type", "").startswith("application/json"):
+            result.update({k: v for k, v in json.loads(payload).items() if k not in result or v is not None})
+        elif name == "enhanced_image":
+            result["enhanced_image"] = payload
+        elif name.startswith("before_after"):
+            result["before_after"].append(payload)
+    if result["enhanced_image"] is None:
+        raise ValueError("multipart response has no enhanced_image part")
+    return result
+
+
+def parse_json(body):
+    """Build a result dict from a JSON response with inline base64 images
+
+    Returns the parsed document unchanged when the images are not inline, so
+    the caller can fetch them by result id.
+    """
+    result = json.loads(bytes(body))
+    if isinstance(result, dict) and isinstance(result.get("enhanced_image"), str):
+        result["enhanced_image"] = decode_base64_image(result["enhanced_image"])
+        result["before_after"] = [decode_base64_image(img) for img in result.get("before_after") or []]
+    return result
@@ -0,0 +1,329 @@
+"""Pre-flight preparation of images before they are uploaded
+
+Detects the real format, downscales to what the chosen model can use, strips
+metadata and picks a compact encoding with the correct MIME type. Images that
+already fit, in a format the backend accepts, skip all of that and are
+streamed from the caller's file (stream_upload); their metadata (EXIF, which
+can hold a GPS position, XMP and text comments) is cut out of the container
+on the way, without decoding the image (strip_metadata).
+"""
+import io
+import struct
+
+import numpy as np
+from PIL import Image
+
+from . import config
+
+MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+EXTENSIONS = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp"}
+
+# Formats the backend accepts as-is
+PASSTHROUGH_FORMATS = {"PNG", "JPEG", "WEBP"}
+
+# 16-bit modes (e.g. FITS exported to PNG) that Pillow cannot resample directly
+WIDE_MODES = ("I;16", "I;16B", "I;16L")
+
+# Metadata cut out of images sent as they are. Colour profiles (JPEG APP2,
+# PNG iCCP, WebP ICCP) and JFIF/Adobe markers are kept: they change how the
+# pixels are read.
+JPEG_METADATA_MARKERS = {0xE1, 0xED, 0xFE}  # APP1 (EXIF, XMP), APP13 (IPTC), COM
+PNG_METADATA_CHUNKS = {b"tEXt", b"zTXt", b"iTXt", b"eXIf", b"tIME"}
+WEBP_METADATA_CHUNKS = {b"EXIF", b"XMP "}
+WEBP_METADATA_FLAGS = 0x0C  # VP8X: EXIF and XMP present
+
+
+class PreparedUpload:
+    """What to send, plus what preparation did to it
+
+    data holds the bytes to send, or is None when the caller's file object is
+    sent as it is.
+    """
+
+    def __init__(self, data, filename, mime_type, original_bytes, original_size, size, fileobj=None):
+        self.data = data
+        self.filename = filename
+        self.mime_type = mime_type
+        self.original_bytes = original_bytes
+        self.original_size = original_size
+        self.size = size
+        self._fileobj = fileobj
+        self._start = fileobj.tell() if fileobj is not None else 0
+        if data is None:
+            fileobj.seek(0, io.SEEK_END)
+            self.sent_bytes = fileobj.tell() - self._start
+            fileobj.seek(self._start)
+        else:
+            self.sent_bytes = len(data)
+
+    def open(self):
+        """File object to stream the upload from"""
+        if self.data is None:
+            self._fileobj.seek(self._start)
+            return self._fileobj
+        return io.BytesIO(self.data)
+
+    @property
+    def resized(self):
+        return self.size != self.original_size
+
+    def stats(self):
+        return {
+            "original_bytes": self.original_bytes,
+            "sent_bytes": self.sent_bytes,
+            "original_size": list(self.original_size),
+            "sent_size": list(self.size),
+        }
+
+
+def max_input_size(model_name):
+    """Longest input edge worth sending to model_name"""
+    return config.MODEL_MAX_INPUT.get(model_name, config.DEFAULT_MAX_INPUT)
+
+
+def _rename(filename, image_format):
+    stem = filename.rsplit(".", 1)[0] if "." in filename else filename
+    return stem + EXTENSIONS[image_format]
+
+
+def _shrink(image, max_size):
+    """Downscale to max_size on the longest edge, keeping 16-bit images 16-bit"""
+    if image.mode not in WIDE_MODES:
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+        return image
+    # Resample as 32-bit integers, then clip Lanczos overshoot back into range
+    resized = image.convert("I")
+    resized.thumbnail((max_size, max_size), Image.LANCZOS)
+    return Image.fromarray(np.clip(np.asarray(resized), 0, 65535).astype(np.uint16))
+
+
+class SplicedFile(io.RawIOBase):
+    """Read-only file made of byte ranges of another file and literal bytes
+
+    pieces are (offset, length) ranges of fileobj or bytes objects; ranges are
+    read from fileobj only when they are reached.
+    """
+
+    def __init__(self, fileobj, pieces):
+        self._file = fileobj
+        self._pieces = pieces
+        self._lengths = [len(p) if isinstance(p, bytes) else p[1] for p in pieces]
+        self._size = sum(self._lengths)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._size}[whence]
+        self._pos = max(base + offset, 0)
+        return self._pos
+
+    def readinto(self, buffer):
+        start = 0
+        for piece, length in zip(self._pieces, self._lengths):
+            if self._pos < start + length:
+                skip = self._pos - start
+                count = min(len(buffer), length - skip)
+                if isinstance(piece, bytes):
+                    chunk = piece[skip:skip + count]
+                else:
+                    self._file.seek(piece[0] + skip)
+                    chunk = self._file.read(count)
+                buffer[:len(chunk)] = chunk
+                self._pos += len(chunk)
+                return len(chunk)
+            start += length
+        return 0
+
+
+def _jpeg_metadata(fileobj, start, end):
+    """(offset, length) of the metadata segments before the image data"""
+    ranges = []
+    pos = start + 2
+    while True:
+        fileobj.seek(pos)
+        header = fileobj.read(4)
+        if len(header) < 4 or header[0] != 0xFF:
+            return ranges
+        marker = header[1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            pos += 1
+        elif marker in (0xDA, 0xD9):
+            # Start of scan or end of image: no more metadata segments
+            return ranges
+        elif marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            pos += 2
+        else:
+            length = 2 + struct.unpack(">H", header[2:])[0]
+            if pos + length > end:
+                return ranges
+            if marker in JPEG_METADATA_MARKERS:
+                ranges.append((pos, length))
+            pos += length
+
+
+def _png_metadata(fileobj, start, end):
+    ranges = []
+    pos = start + 8
+    while True:
+        fileobj.seek(pos)
+        header = fileobj.read(8)
+        if len(header) < 8:
+            return ranges
+        length, chunk_type = struct.unpack(">I4s", header)
+        # Length and type, data, CRC
+        size = 12 + length
+        if pos + size > end:
+            return ranges
+        if chunk_type in PNG_METADATA_CHUNKS:
+            ranges.append((pos, size))
+        if chunk_type == b"IEND":
+            return ranges
+        pos += size
+
+
+def _webp_metadata(fileobj, start, end):
+    """Metadata chunks, and the (offset, patched bytes) of the VP8X chunk that announces them"""
+    ranges, vp8x = [], None
+    pos = start + 12
+    while pos + 8 <= end:
+        fileobj.seek(pos)
+        chunk_type, length = struct.unpack("<4sI", fileobj.read(8))
+        # Chunks are padded to an even length
+        size = 8 + length + (length & 1)
+        if pos + size > end:
+            break
+        if chunk_type == b"VP8X":
+            fileobj.seek(pos)
+            chunk = bytearray(fileobj.read(size))
+            chunk[8] &= ~WEBP_METADATA_FLAGS & 0xFF
+            vp8x = (pos, bytes(chunk))
+        elif chunk_type in WEBP_METADATA_CHUNKS:
+            ranges.append((pos, size))
+        pos += size
+    return ranges, vp8x
+
+
+def strip_metadata(fileobj, image_format):
+    """fileobj from its current position, with EXIF, XMP and text metadata cut out
+
+    Only chunk and segment headers are read; the result streams the rest from
+    fileobj. Returns fileobj itself when there is nothing to cut.
+    """
+    start = fileobj.tell()
+    fileobj.seek(0, io.SEEK_END)
+    end = fileobj.tell()
+    patches = {}
+    try:
+        if image_format == "JPEG":
+            ranges = _jpeg_metadata(fileobj, start, end)
+        elif image_format == "PNG":
+            ranges = _png_metadata(fileobj, start, end)
+        elif image_format == "WEBP":
+            ranges, vp8x = _webp_metadata(fileobj, start, end)
+            if ranges:
+                # The RIFF header's size covers everything after its first 8 bytes
+                size = end - start - sum(length for _, length in ranges) - 8
+                patches[start] = struct.pack("<4sI", b"RIFF", size)
+                if vp8x is not None:
+                    patches[vp8x[0]] = vp8x[1]
+        else:
+            ranges = []
+    finally:
+        fileobj.seek(start)
+    if not ranges:
+        return fileobj
+
+    pieces = []
+    pos = start
+    cuts = sorted([(offset, length, None) for offset, length in ranges] +
+                  [(offset, len(data), data) for offset, data in patches.items()])
+    for offset, length, data in cuts:
+        if offset > pos:
+            pieces.append((pos, offset - pos))
+        if data is not None:
+            pieces.append(data)
+        pos = offset + length
+    if end > pos:
+        pieces.append((pos, end - pos))
+    return SplicedFile(fileobj, pieces)
+
+
+def _without_metadata(data, image_format):
+    return strip_metadata(io.BytesIO(data), image_format).read()
+
+
+def stream_upload(fileobj, filename, max_size=None):
+    """Upload that sends fileobj as it is, or None if the image has to be prepared
+
+    Only the header is parsed, so an image that already fits max_size, in a
+    format the backend accepts, is never decoded, re-encoded or read into
+    memory. Its metadata is cut out as it is sent (see strip_metadata).
+    """
+    start = fileobj.tell()
+    try:
+        with Image.open(fileobj) as image:
+            image_format, size = image.format, image.size
+    finally:
+        fileobj.seek(start)
+    if image_format not in PASSTHROUGH_FORMATS or (max_size and max(size) > max_size):
+        return None
+    fileobj.seek(0, io.SEEK_END)
+    length = fileobj.tell() - start
+    fileobj.seek(start)
+    return PreparedUpload(None, _rename(filename, image_format), MIME_TYPES[image_format], length, size, size,
+                          strip_metadata(fileobj, image_format))
+
+
+def prepare_upload(data, filename, max_size=None):
+    """Prepare encoded image bytes for upload
+
+    Lossless sources are re-encoded as PNG and lossy ones as high-quality
+    JPEG. An image that needs no resizing keeps its original bytes, less
+    their metadata, whenever re-encoding would not make it smaller, so JPEGs
+    never lose a generation for nothing.
+    """
+    image = Image.open(io.BytesIO(data))
+    source_format = image.format
+    original_size = image.size
+
+    target_format = "JPEG" if source_format == "JPEG" else "PNG"
+    if max_size and max(image.size) > max_size:
+        if source_format == "JPEG":
+            # Decode at a reduced scale when the target allows it
+            image.draft(image.mode, (max_size, max_size))
+        image = _shrink(image, max_size)
+    elif source_format == "JPEG":
+        return PreparedUpload(_without_metadata(data, "JPEG"), _rename(filename, "JPEG"), MIME_TYPES["JPEG"],
+                              len(data), original_size, original_size)
+
+    if target_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    elif target_format == "PNG" and image.mode in ("P", "CMYK", "YCbCr", "LAB", "HSV"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+    # Saving without exif/pnginfo drops metadata; keep the colour profile
+    buffered = io.BytesIO()
+    save_args = {"icc_profile": image.info["icc_profile"]} if image.info.get("icc_profile") else {}
+    if target_format == "JPEG":
+        save_args.update(quality=config.UPLOAD_JPEG_QUALITY, subsampling=0)
+    else:
+        save_args.update(optimize=True)
+    image.save(buffered, format=target_format, **save_args)
+    encoded = buffered.getvalue()
+
+    if image.size == original_size and source_format in PASSTHROUGH_FORMATS:
+        original = _without_metadata(data, source_format)
+        if len(encoded) >= len(original):
+            return PreparedUpload(original, _rename(filename, source_format), MIME_TYPES[source_format],
+                                  len(data), original_size, original_size)
+    return PreparedUpload(encoded, _rename(filename, target_format), MIME_TYPES[target_format],
+                          len(data), original_size, image.size)
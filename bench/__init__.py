@@ -0,0 +1 @@
+"""Local mock backend and benchmark harness for the enhancement client"""
@@ -0,0 +1,219 @@
+"""Latency and throughput benchmark of the enhancement client
+
+Starts the mock backend in a subprocess (so its CPU time is not charged to
+the client) and drives the real client code through three scenarios:
+
+* single: requests one after another
+* concurrent: several threads issuing requests at once
+* batch: the batch runner writing results into a ZIP archive
+
+For each it reports p50/p95/p99 latency, throughput, bytes on the wire and
+client-side CPU time. Bytes come from the backend's /stats when it has one
+(the mock does); otherwise from the client's own per-phase byte counts.
+
+    python -m bench.benchmark --requests 50 --concurrency 8 --latency 0.5
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+DEFAULT_IMAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "heic2017a.jpg")
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def start_mock(args):
+    """Launch bench.mock_backend on a free port and return (process, url)"""
+    command = [
+        sys.executable, "-m", "bench.mock_backend", "--port", "0",
+        "--latency", str(args.latency), "--jitter", str(args.jitter),
+        "--error-rate", str(args.error_rate), "--output-size", args.output_size,
+        "--response", args.response,
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True,
+                               cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    line = process.stdout.readline().strip()
+    if not line.startswith("listening on "):
+        process.kill()
+        raise RuntimeError(f"mock backend failed to start: {line!r}")
+    return process, line.split("listening on ", 1)[1]
+
+
+# Trace phases whose byte counts are request bodies sent / response bodies received
+SENT_PHASES = ("request",)
+RECEIVED_PHASES = ("download", "fetch_image")
+
+
+def wire_stats(url):
+    """Byte counters from the backend's /stats, or None if it does not serve them"""
+    try:
+        response = requests.get(f"{url}/stats", timeout=5)
+        stats = response.json() if response.status_code == 200 else None
+    except (requests.RequestException, ValueError):
+        return None
+    if not isinstance(stats, dict) or "bytes_in" not in stats or "bytes_out" not in stats:
+        return None
+    return stats
+
+
+def client_stats():
+    """Byte counters in the shape of /stats, counted by this process's client"""
+    from astro_enhancer.metrics import registry
+
+    def total(phases):
+        return sum(registry.value("phase_bytes_total", phase=p) for p in phases)
+    return {"bytes_in": total(SENT_PHASES), "bytes_out": total(RECEIVED_PHASES)}
+
+
+class Scenario:
+    """Timings collected while running one scenario"""
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def record(self, fn):
+        start = time.perf_counter()
+        try:
+            fn()
+        except Exception:
+            with self.lock:
+                self.errors += 1
+            return
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies.append(elapsed)
+
+    def run(self, url, body):
+        before, client_before = wire_stats(url), client_stats()
+        cpu, wall = time.process_time(), time.perf_counter()
+        body()
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+        after, client_after = wire_stats(url), client_stats()
+        bytes_from = "backend"
+        if before is None or after is None:
+            before, after, bytes_from = client_before, client_after, "client"
+        return {
+            "scenario": self.name,
+            "ok": len(self.latencies),
+            "errors": self.errors,
+            "p50": percentile(self.latencies, 50),
+            "p95": percentile(self.latencies, 95),
+            "p99": percentile(self.latencies, 99),
+            "throughput": len(self.latencies) / wall if wall else 0.0,
+            "wall_s": wall,
+            "client_cpu_s": cpu,
+            "mb_sent": (after["bytes_in"] - before["bytes_in"]) / 2 ** 20,
+            "mb_received": (after["bytes_out"] - before["bytes_out"]) / 2 ** 20,
+            "bytes_from": bytes_from,
+        }
+
+
+def run_benchmark(args, url):
+    from astro_enhancer.batch import BatchItem, ZipSink, Batch
+    from astro_enhancer.pipeline import enhance
+
+    with open(args.image, "rb") as f:
+        image = f.read()
+    settings = dict(model_name=args.model, preset="General Astronomy", cacheable=False,
+                    downscale=not args.no_downscale, base_url=url)
+
+    def one():
+        enhance(io.BytesIO(image), os.path.basename(args.image), **settings)
+
+    reports = []
+    if "single" in args.scenarios:
+        single = Scenario("single")
+        reports.append(single.run(url, lambda: [single.record(one) for _ in range(args.requests)]))
+
+    if "concurrent" in args.scenarios:
+        concurrent = Scenario(f"concurrent x{args.concurrency}")
+
+        def fan_out():
+            with ThreadPoolExecutor(args.concurrency) as pool:
+                list(pool.map(lambda _: concurrent.record(one), range(args.requests)))
+        reports.append(concurrent.run(url, fan_out))
+
+    if "batch" in args.scenarios:
+        batch_scenario = Scenario(f"batch x{args.concurrency}")
+
+        def batch_run():
+            with tempfile.TemporaryDirectory() as tmp:
+                items = [BatchItem(f"frame{i}.jpg", lambda: image) for i in range(args.requests)]
+                batch = Batch(items, ZipSink(os.path.join(tmp, "out.zip")), args.concurrency, **settings)
+                batch.run()
+                for item in items:
+                    if item.status == "done":
+                        batch_scenario.latencies.append(item.duration)
+                    else:
+                        batch_scenario.errors += 1
+        reports.append(batch_scenario.run(url, batch_run))
+    return reports
+
+
+def format_report(reports):
+    header = (f"{'scenario':<16}{'ok':>5}{'err':>5}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}"
+              f"{'req/s':>8}{'cpu s':>8}{'MB out':>9}{'MB in':>9}")
+    lines = [header, "-" * len(header)]
+    for r in reports:
+        lines.append(f"{r['scenario']:<16}{r['ok']:>5}{r['errors']:>5}{r['p50']:>9.3f}{r['p95']:>9.3f}"
+                     f"{r['p99']:>9.3f}{r['throughput']:>8.2f}{r['client_cpu_s']:>8.2f}"
+                     f"{r['mb_sent']:>9.2f}{r['mb_received']:>9.2f}")
+    if any(r["bytes_from"] == "client" for r in reports):
+        lines.append("MB out/in counted client-side (request and response bodies): the backend has no /stats")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="benchmark a running backend instead of starting the mock")
+    parser.add_argument("--image", default=DEFAULT_IMAGE)
+    parser.add_argument("--model", default="Stable Diffusion Upscaler (4x)")
+    parser.add_argument("--requests", type=int, default=20, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--scenarios", nargs="+", default=["single", "concurrent", "batch"],
+                        choices=["single", "concurrent", "batch"])
+    parser.add_argument("--no-downscale", action="store_true")
+    parser.add_argument("--latency", type=float, default=0.2, help="mock: mean seconds per enhancement")
+    parser.add_argument("--jitter", type=float, default=0.25, help="mock: latency std-dev fraction")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="mock: fraction of 500 responses")
+    parser.add_argument("--output-size", default="2048x2048", help="mock: WxH of the returned image")
+    parser.add_argument("--response", default="auto", choices=["auto", "json", "multipart", "id"],
+                        help="mock: response transport")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    process = None
+    url = args.url
+    if url is None:
+        process, url = start_mock(args)
+    try:
+        reports = run_benchmark(args, url)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    print(json.dumps(reports, indent=2) if args.json else format_report(reports))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""Local stand-in for the FastAPI enhancement backend
+
+Serves /models, /presets and /enhance_image (plus /results/<id>/... for the
+fetch-by-id transport) with configurable latency, payload size and error
+rates, so the client can be measured without a GPU or a tunnel.
+
+    python -m bench.mock_backend --port 8000 --latency 2 --error-rate 0.05
+"""
+import argparse
+import base64
+import email.parser
+import email.policy
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+MODELS = [
+    "Stable Diffusion Upscaler (4x)",
+    "ESRGAN Plus (4x)",
+    "SwinIR (4x)",
+    "Codeformer (Face Enhancement)",
+    "Real-ESRGAN (4x)",
+]
+PRESETS = [
+    "General Astronomy",
+    "Galaxy",
+    "Nebula",
+    "Planet",
+    "Star Cluster",
+    "Solar Surface",
+    "Black Hole",
+    "Deep Field",
+    "Scientific Accuracy",
+]
+
+
+def noise_png(width, height, seed=0):
+    """A PNG of random noise, which barely compresses, as a stand-in payload"""
+    rng = random.Random(seed)
+    image = Image.frombytes("RGB", (width, height), rng.randbytes(width * height * 3))
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG", compress_level=1)
+    return buffered.getvalue()
+
+
+class MockSettings:
+    def __init__(self, latency=1.0, jitter=0.25, error_rate=0.0, throttle_rate=0.0, output_size=(2048, 2048),
+                 upscale=False, scale=4, response="auto", models=MODELS):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.output_size = output_size
+        self.upscale = upscale
+        self.scale = scale
+        self.response = response
+        self.models = models
+
+
+class MockState:
+    """Shared counters and stored results of one mock server"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.payload = None if settings.upscale else noise_png(*settings.output_size)
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "enhance_requests": 0, "errors": 0, "bytes_in": 0, "bytes_out": 0,
+                      "in_flight": 0, "max_in_flight": 0}
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.stats[key] += value
+
+    def store(self, result_id, images):
+        with self.lock:
+            self.results[result_id] = images
+            while len(self.results) > 64:
+                self.results.popitem(last=False)
+
+
+def parse_form(content_type, body):
+    """Fields and files of a multipart/form-data body"""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+    )
+    fields, files = {}, {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if part.get_filename() is not None:
+            files[name] = part.get_payload(decode=True)
+        else:
+            fields[name] = part.get_payload(decode=True).decode()
+    return fields, files
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b"", content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.state.count("bytes_out", len(body))
+
+    def _json(self, value, status=200, headers=None):
+        self._send(status, json.dumps(value).encode(), headers=headers)
+
+    def _catalog(self, value):
+        etag = '"' + hashlib.sha1(json.dumps(value).encode()).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self._json(value, headers={"ETag": etag})
+
+    def do_GET(self):
+        self.state.count("requests")
+        path = self.path.split("?", 1)[0]
+        if path == "/models":
+            return self._catalog(self.state.settings.models)
+        if path == "/presets":
+            return self._catalog(PRESETS)
+        if path == "/stats":
+            with self.state.lock:
+                stats = dict(self.state.stats)
+            return self._json(stats)
+        if path.startswith("/results/"):
+            parts = path.split("/")[2:]
+            with self.state.lock:
+                images = self.state.results.get(parts[0])
+            if images is None:
+                return self._json({"detail": "unknown result"}, 404)
+            name = "/".join(parts[1:])
+            if name == "enhanced_image":
+                return self._send(200, images[0], "image/png")
+            if name.startswith("before_after/"):
+                index = int(name.rsplit("/", 1)[1])
+                if index < len(images) - 1:
+                    return self._send(200, images[index + 1], "image/png")
+            return self._json({"detail": "unknown image"}, 404)
+        self._json({"detail": "Not Found"}, 404)
+
+    def do_POST(self):
+        self.state.count("requests")
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.state.count("bytes_in", len(body))
+        if self.path.split("?", 1)[0] != "/enhance_image":
+            return self._json({"detail": "Not Found"}, 404)
+
+        settings = self.state.settings
+        self.state.count("enhance_requests")
+        roll = random.random()
+        if roll < settings.throttle_rate:
+            self.state.count("errors")
+            return self._json({"detail": "Too many requests"}, 429, headers={"Retry-After": "1"})
+        if roll < settings.throttle_rate + settings.error_rate:
+            self.state.count("errors")
+            return self._json({"detail": "CUDA out of memory"}, 500)
+
+        fields, files = parse_form(self.headers["Content-Type"], body)
+        if fields.get("model_name") not in settings.models:
+            return self._json({"detail": f"Unknown model: {fields.get('model_name')}"}, 400)
+
+        with self.state.lock:
+            self.state.stats["in_flight"] += 1
+            self.state.stats["max_in_flight"] = max(self.state.stats["max_in_flight"], self.state.stats["in_flight"])
+        try:
+            inference = max(0.0, random.gauss(settings.latency, settings.jitter * settings.latency))
+            time.sleep(inference)
+            original = files["image"]
+            if settings.upscale:
+                image = Image.open(io.BytesIO(original)).convert("RGB")
+                image = image.resize((image.width * settings.scale, image.height * settings.scale), Image.BICUBIC)
+                buffered = io.BytesIO()
+                image.save(buffered, format="PNG", compress_level=1)
+                enhanced = buffered.getvalue()
+            else:
+                enhanced = self.state.payload
+        finally:
+            self.state.count("in_flight", -1)
+
+        prompt = f"{fields.get('preset')} enhancement" + (f", {fields['custom_prompt']}" if "custom_prompt" in fields else "")
+        before_after = [original, enhanced] if fields.get("include_before_after") != "false" else []
+        self._respond(enhanced, before_after, prompt, {"Server-Timing": f"inference;dur={inference * 1000:.1f}"})
+
+    def _respond(self, enhanced, before_after, prompt, headers):
+        mode = self.state.settings.response
+        if mode == "auto":
+            mode = "multipart" if "multipart/mixed" in self.headers.get("Accept", "") else "json"
+
+        if mode == "json":
+            encoded = [base64.b64encode(img).decode() for img in [enhanced] + before_after]
+            return self._json({"enhanced_image": encoded[0], "prompt_used": prompt, "before_after": encoded[1:]},
+                              headers=headers)
+        if mode == "id":
+            result_id = uuid.uuid4().hex
+            self.state.store(result_id, [enhanced] + before_after)
+            return self._json({"result_id": result_id, "prompt_used": prompt, "before_after_count": len(before_after)},
+                              headers=headers)
+
+        boundary = uuid.uuid4().hex
+        parts = [
+            ("metadata", "application/json", json.dumps({"prompt_used": prompt}).encode()),
+            ("enhanced_image", "image/png", enhanced),
+        ] + [(f"before_after_{i}", "image/png", img) for i, img in enumerate(before_after)]
+        chunks = []
+        for name, content_type, payload in parts:
+            chunks.append(f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+                          f"Content-Disposition: form-data; name=\"{name}\"\r\n\r\n".encode())
+            chunks += [payload, b"\r\n"]
+        chunks.append(f"--{boundary}--\r\n".encode())
+        self._send(200, b"".join(chunks), f"multipart/mixed; boundary={boundary}", headers)
+
+
+class MockBackend:
+    """A mock server running on a background thread"""
+
+    def __init__(self, settings=None, host="127.0.0.1", port=0):
+        self.state = MockState(settings or MockSettings())
+        handler = type("Handler", (MockHandler,), {"state": self.state})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mock-backend", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def parse_size(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000, help="0 picks a free port")
+    parser.add_argument("--latency", type=float, default=1.0, help="mean seconds per enhancement")
+    parser.add_argument("--jitter", type=float, default=0.25, help="latency std-dev, as a fraction of the mean")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of enhancements answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction answered with 429")
+    parser.add_argument("--output-size", type=parse_size, default=(2048, 2048), help="WxH of the fixed payload")
+    parser.add_argument("--upscale", action="store_true", help="really upscale the input instead")
+    parser.add_argument("--response", choices=["auto", "json", "multipart", "id"], default="auto")
+    args = parser.parse_args(argv)
+
+    settings = MockSettings(args.latency, args.jitter, args.error_rate, args.throttle_rate, args.output_size,
+                            args.upscale, response=args.response)
+    backend = MockBackend(settings, args.host, args.port)
+    print(f"listening on {backend.url}", flush=True)
+    try:
+        backend.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
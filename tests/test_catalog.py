@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from astro_enhancer.catalog import CatalogCache
+
+URL = "http://backend/models"
+
+
+class FakeBackend:
+    """get_json stand-in: serves a value with an ETag, answering 304 (None) when it still matches"""
+
+    def __init__(self, value=("ESRGAN",), etag='"v1"'):
+        self.value = value
+        self.etag = etag
+        self.calls = []
+        self.error = None
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, url, etag=None):
+        self.gate.wait()
+        self.calls.append(etag)
+        if self.error is not None:
+            raise self.error
+        if etag == self.etag:
+            return None, self.etag
+        return self.value, self.etag
+
+
+def age(cache, seconds):
+    cache._entry(URL).fetched_at = time.monotonic() - seconds
+
+
+def test_fresh_catalog_is_served_from_memory():
+    backend = FakeBackend()
+    cache = CatalogCache(backend, ttl=60, max_stale=600)
+    assert cache.get(URL) == ("ESRGAN",)
+    assert cache.get(URL) == ("ESRGAN",)
+    assert backend.calls == [None]
+
+
+def test_stale_catalog_is_served_while_it_revalidates_in_the_background():
+    backend = FakeBackend()
+    cache = CatalogCache(backend, ttl=60, max_stale=600)
+    cache.get(URL)
+    age(cache, 120)
+    backend.gate.clear()
+    # Returns at once, even though the refresh is blocked
+    assert cache.get(URL) == ("ESRGAN",)
+    backend.gate.set()
+    for _ in range(1000):
+        if len(backend.calls) == 2 and not cache._entry(URL).refreshing:
+            break
+        time.sleep(0.001)
+    # Revalidated with the ETag; the 304 keeps the value and renews it
+    assert backend.calls == [None, '"v1"']
+    assert cache._entry(URL).age(time.monotonic()) < 60
+    assert cache.get(URL) == ("ESRGAN",)
+
+
+def test_changed_catalog_replaces_the_old_one():
+    backend = FakeBackend()
+    cache = CatalogCache(backend, ttl=60, max_stale=0)
+    cache.get(URL)
+    backend.value, backend.etag = ("ESRGAN", "SwinIR"), '"v2"'
+    age(cache, 120)
+    assert cache.get(URL) == ("ESRGAN", "SwinIR")
+
+
+def test_failures_are_remembered_for_the_error_ttl():
+    backend = FakeBackend()
+    backend.error = ConnectionError("down")
+    cache = CatalogCache(backend, ttl=60, max_stale=0, error_ttl=60)
+    with pytest.raises(ConnectionError):
+        cache.get(URL)
+    with pytest.raises(ConnectionError):
+        cache.get(URL)
+    assert len(backend.calls) == 1
+    cache.invalidate(URL)
+    backend.error = None
+    assert cache.get(URL) == ("ESRGAN",)
@@ -0,0 +1,28 @@
+import base64
+import io
+import json
+
+import pytest
+import requests
+
+from astro_enhancer.client import APIError, read_result
+
+
+def response(body, content_type="application/json", status=200):
+    result = requests.Response()
+    result.status_code = status
+    result.headers["Content-Type"] = content_type
+    result.raw = io.BytesIO(body)
+    return result
+
+
+def test_read_result_decodes_inline_json():
+    body = json.dumps({"enhanced_image": base64.b64encode(b"png").decode(), "prompt_used": "p"}).encode()
+    assert read_result("http://backend", response(body))["enhanced_image"] == b"png"
+
+
+@pytest.mark.parametrize("body", [b'{"detail": "model is loading"}', b'{"enhanced_image": null}', b"[]"])
+def test_read_result_rejects_responses_without_an_image(body):
+    with pytest.raises(APIError) as error:
+        read_result("http://backend", response(body))
+    assert error.value.status_code == 200
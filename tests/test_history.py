@@ -0,0 +1,82 @@
+import io
+import json
+import time
+
+import pytest
+from PIL import Image
+
+from astro_enhancer import history as history_module
+from astro_enhancer import pipeline
+from astro_enhancer.history import HistoryStore, enhance_and_record
+from astro_enhancer.jobs import DONE, JobManager
+from astro_enhancer.result_cache import ResultCache
+from bench.mock_backend import MockBackend, MockSettings
+
+MODEL = "ESRGAN Plus (4x)"
+
+
+def png(seed=0, size=(32, 32)):
+    buffered = io.BytesIO()
+    Image.new("RGB", size, (seed % 256, 0, 0)).save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def wait(manager, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not manager.get(job_id).finished:
+        assert time.monotonic() < deadline, "job did not finish"
+        time.sleep(0.01)
+    return manager.collect(job_id)
+
+
+@pytest.fixture
+def backend():
+    with MockBackend(MockSettings(latency=0.05, jitter=0, output_size=(64, 64))) as mock:
+        yield mock
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = HistoryStore(str(tmp_path / "history"))
+    monkeypatch.setattr(history_module, "history", store)
+    monkeypatch.setattr(pipeline, "results", ResultCache(str(tmp_path / "cache"), disk_mb=16))
+    return store
+
+
+def test_enhance_and_record_as_a_background_job(backend, store):
+    manager = JobManager(workers=1)
+    # Called the way app.py submits a single-image run
+    job_id = manager.submit(enhance_and_record, io.BytesIO(png()), "m31.png", MODEL, "Galaxy", None, 20.0, False,
+                            cacheable=True, downscale=True, tiled=False, base_url=backend.url,
+                            label=MODEL, owner="alice")
+    job = wait(manager, job_id)
+    assert job.error is None and job.status == DONE
+    assert manager.get(job_id) is None
+
+    run = store.get(job.result["history_id"], owner="alice")
+    assert run["filename"] == "m31.png" and run["model"] == MODEL
+    assert json.loads(run["settings"])["downscale"] is True
+    with open(store.blob_path(run["output_sha"]), "rb") as f:
+        assert f.read() == job.result["enhanced_image"]
+
+
+def test_runs_are_scoped_to_their_owner(backend, store):
+    result = pipeline.enhance(io.BytesIO(png()), "a.png", MODEL, "Galaxy", base_url=backend.url)
+    alice = store.record(png(), "a.png", result, MODEL, "Galaxy", owner="alice")
+    store.record(png(1), "b.png", result, MODEL, "Galaxy", owner="bob")
+    assert store.count() == 2
+    assert store.count(owner="alice") == 1
+    assert [run["filename"] for run in store.page(owner="bob")] == ["b.png"]
+    assert store.get(alice, owner="bob") is None
+    assert store.get(alice, owner="alice")["filename"] == "a.png"
+
+
+def test_oldest_runs_are_evicted_over_the_size_bound(backend, store):
+    result = pipeline.enhance(io.BytesIO(png()), "a.png", MODEL, "Galaxy", base_url=backend.url)
+    first = store.record(png(0), "0.png", result, MODEL, "Galaxy")
+    store.max_bytes = store._disk_usage() + len(png(1))
+    for i in range(1, 4):
+        store.record(png(i), f"{i}.png", result, MODEL, "Galaxy")
+    assert store.get(first) is None
+    assert store.count() < 4
+    assert store._disk_usage() <= store.max_bytes
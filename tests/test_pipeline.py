@@ -0,0 +1,113 @@
+import io
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+from astro_enhancer import client, config, pipeline
+from astro_enhancer.batch import Batch, BatchItem, ZipSink
+from astro_enhancer.result_cache import ResultCache
+from astro_enhancer.scheduler import INTERACTIVE, FairGate, acting_as
+from astro_enhancer.tiling import enhance_tiled
+from bench.mock_backend import MockBackend, MockSettings
+
+MODEL = "ESRGAN Plus (4x)"
+
+
+def png(seed=0, size=(32, 32)):
+    buffered = io.BytesIO()
+    Image.new("RGB", size, (seed % 256, 0, 0)).save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+@pytest.fixture
+def backend():
+    with MockBackend(MockSettings(latency=0.2, jitter=0, output_size=(64, 64))) as mock:
+        yield mock
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, "results", ResultCache(str(tmp_path), disk_mb=16))
+
+
+def test_enhance_uses_the_cache_the_second_time(backend):
+    first = pipeline.enhance(io.BytesIO(png()), "a.png", MODEL, "Galaxy", base_url=backend.url)
+    second = pipeline.enhance(io.BytesIO(png()), "a.png", MODEL, "Galaxy", base_url=backend.url)
+    assert first["upload"] is not None and second["upload"] is None
+    assert second["enhanced_image"] == first["enhanced_image"]
+    assert backend.state.stats["enhance_requests"] == 1
+
+
+def test_identical_concurrent_requests_share_one_backend_call(backend):
+    results = []
+
+    def enhance():
+        results.append(pipeline.enhance(io.BytesIO(png()), "a.png", MODEL, "Galaxy", base_url=backend.url))
+
+    threads = [threading.Thread(target=enhance) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.state.stats["enhance_requests"] == 1
+    assert len({r["enhanced_image"] for r in results}) == 1
+    # Only the caller that made the run uploaded anything
+    assert sum(r["upload"] is not None for r in results) == 1
+
+
+def test_batch_items_wait_for_slots_instead_of_failing(backend, tmp_path, monkeypatch):
+    monkeypatch.setattr(client, "_enhance_slots", FairGate(2))
+    monkeypatch.setattr(config, "ENHANCE_QUEUE_TIMEOUT", 0.05)
+    items = [BatchItem(f"{i}.png", lambda i=i: png(i)) for i in range(6)]
+    batch = Batch(items, ZipSink(str(tmp_path / "out.zip")), 6, model_name=MODEL, preset="Galaxy",
+                  base_url=backend.url)
+    batch.run()
+    assert batch.counts()["done"] == 6
+
+
+def test_interactive_runs_go_ahead_of_a_running_batch(backend, tmp_path, monkeypatch):
+    monkeypatch.setattr(client, "_enhance_slots", FairGate(1))
+    items = [BatchItem(f"{i}.png", lambda i=i: png(i)) for i in range(4)]
+    batch = Batch(items, ZipSink(str(tmp_path / "out.zip")), 4, model_name=MODEL, preset="Galaxy",
+                  base_url=backend.url, cacheable=False)
+    batch.start(owner="heavy")
+    assert not batch.finished
+    while not batch.counts()["running"]:
+        time.sleep(0.01)
+    with acting_as("casual", INTERACTIVE, background=True):
+        pipeline.enhance(io.BytesIO(png(99)), "a.png", MODEL, "Galaxy", base_url=backend.url)
+    # At most the item already holding the slot got in first
+    assert batch.counts()["done"] <= 1
+    while not batch.finished:
+        time.sleep(0.01)
+    assert batch.counts()["done"] == 4
+
+
+def test_tiles_of_a_background_job_wait_for_slots(backend, monkeypatch):
+    monkeypatch.setattr(client, "_enhance_slots", FairGate(2))
+    monkeypatch.setattr(config, "ENHANCE_QUEUE_TIMEOUT", 0.05)
+    data = {"model_name": MODEL, "preset": "Galaxy"}
+
+    def tiled():
+        return enhance_tiled(io.BytesIO(png(size=(96, 96))), data, 32, backend.url, overlap=8, workers=6)
+
+    with pytest.raises(client.BackendBusy):
+        tiled()
+    with acting_as("session", background=True):
+        assert tiled()["tiles"] == 16
+
+
+def test_images_that_fit_are_streamed_untouched(backend, monkeypatch):
+    from astro_enhancer import upload
+
+    def no_decoding(*args, **kwargs):
+        raise AssertionError("prepare_upload should not run")
+
+    monkeypatch.setattr(pipeline, "prepare_upload", no_decoding)
+    data = png(size=(64, 64))
+    result = pipeline.enhance(io.BytesIO(data), "a.png", MODEL, "Galaxy", base_url=backend.url)
+    assert result["upload"]["sent_bytes"] == len(data)
+    assert backend.state.stats["bytes_in"] > len(data)
+    assert upload.stream_upload(io.BytesIO(png(size=(64, 64))), "a.png", max_size=32) is None
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+
+import pytest
+
+from astro_enhancer.result_cache import DiskCache, MemoryLRU, SingleFlight, cache_key, pack, unpack
+
+
+def test_cache_key_depends_on_every_parameter():
+    base = cache_key("digest", "model", "preset", None, 20, False)
+    assert base == cache_key("digest", "model", "preset", "", 20.0, False)
+    assert base != cache_key("digest", "model", "preset", None, 20, True)
+    assert base != cache_key("digest", "model", "preset", None, 20, False, variant=1024)
+
+
+def test_pack_round_trip():
+    value = {"enhanced_image": b"\x89PNG", "before_after": [b"a", b"bc"], "prompt_used": "stars", "n": 1}
+    assert unpack(pack(value)) == value
+
+
+def test_memory_lru_bounds_items_and_bytes():
+    lru = MemoryLRU(max_items=2, max_bytes=10)
+    lru.put("a", "A", 4)
+    lru.put("b", "B", 4)
+    lru.get("a")
+    lru.put("c", "C", 4)
+    assert lru.get("b") is None
+    assert lru.get("a") == "A"
+    lru.put("huge", "H", 11)
+    assert lru.get("huge") is None
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=3 * len(pack({"v": b"x" * 100})))
+    for i, key in enumerate(["aa1", "bb2", "cc3"]):
+        cache.put(key, {"v": b"x" * 100})
+        os.utime(cache._path(key), (i, i))
+    # Reading bumps the entry, so the oldest untouched one goes first
+    assert cache.get("aa1") == {"v": b"x" * 100}
+    cache.put("dd4", {"v": b"x" * 100})
+    assert cache.get("bb2") is None
+    assert cache.get("aa1") is not None
+    assert cache.get("dd4") is not None
+
+
+def test_disk_cache_ignores_corrupt_entries(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1 << 20)
+    cache.put("key1", {"v": b"x"})
+    with open(cache._path("key1"), "wb") as f:
+        f.write(b"\x00\x00\x00\x05junk")
+    assert cache.get("key1") is None
+
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def slow():
+        calls.append(1)
+        release.wait()
+        return "result"
+
+    def call():
+        results.append(flight.do("key", slow))
+
+    threads = [threading.Thread(target=call) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while flight.in_flight() != (1, 4):
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(results) == [("result", False)] + [("result", True)] * 4
+    assert flight.in_flight() == (0, 0)
+
+
+def test_single_flight_shares_the_error():
+    flight = SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def failing():
+        release.wait()
+        raise ValueError("backend down")
+
+    def call():
+        try:
+            flight.do("key", failing)
+        except ValueError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    while flight.in_flight() != (1, 2):
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert errors == ["backend down"] * 3
+
+
+def test_single_flight_runs_again_once_finished():
+    flight = SingleFlight()
+    assert flight.do("key", lambda: 1) == (1, False)
+    assert flight.do("key", lambda: 2) == (2, False)
+    with pytest.raises(KeyError):
+        flight.do("other", lambda: {}["missing"])
+    assert flight.in_flight() == (0, 0)
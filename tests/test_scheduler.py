@@ -0,0 +1,125 @@
+import threading
+import time
+
+from astro_enhancer.scheduler import (BULK, INTERACTIVE, STANDARD, FairGate, FairQueue, acting_as, identity,
+                                      in_background)
+
+
+def drain(queue):
+    items = []
+    while True:
+        item = queue.pop()
+        if item is None:
+            return items
+        items.append(item)
+
+
+def test_higher_priority_served_first():
+    queue = FairQueue(quota=10)
+    queue.push("bulk", "a", BULK)
+    queue.push("standard", "b", STANDARD)
+    queue.push("interactive", "c", INTERACTIVE)
+    assert drain(queue) == ["interactive", "standard", "bulk"]
+
+
+def test_owners_take_turns_within_a_priority():
+    queue = FairQueue(quota=10)
+    for i in range(3):
+        queue.push(f"a{i}", "a")
+    queue.push("b0", "b")
+    queue.push("c0", "c")
+    assert drain(queue) == ["a0", "b0", "c0", "a1", "a2"]
+
+
+def test_owner_at_quota_is_skipped_even_for_lower_priority_work():
+    queue = FairQueue(quota=1)
+    queue.push("a0", "a", INTERACTIVE)
+    queue.push("a1", "a", INTERACTIVE)
+    queue.push("b0", "b", BULK)
+    assert queue.pop() == "a0"
+    # a is running one item, its quota; b's bulk item goes next
+    assert queue.pop() == "b0"
+
+
+def test_capacity_is_not_left_idle_when_everyone_is_at_quota():
+    queue = FairQueue(quota=1)
+    queue.push("a0", "a")
+    queue.push("a1", "a")
+    assert queue.pop() == "a0"
+    assert queue.pop() == "a1"
+
+
+def test_done_frees_quota():
+    queue = FairQueue(quota=1)
+    queue.push("a0", "a")
+    assert queue.pop() == "a0"
+    queue.push("a1", "a")
+    queue.push("b0", "b")
+    queue.done("a")
+    assert queue.pop() == "a1"
+
+
+def test_order_predicts_pops_without_changing_the_queue():
+    queue = FairQueue(quota=1)
+    for item, owner, priority in [("a0", "a", BULK), ("a1", "a", BULK), ("b0", "b", STANDARD),
+                                  ("c0", "c", INTERACTIVE), ("b1", "b", STANDARD)]:
+        queue.push(item, owner, priority)
+    predicted = queue.order()
+    assert len(queue) == 5
+    assert queue.depth() == {BULK: 2, STANDARD: 2, INTERACTIVE: 1}
+    assert queue.owners() == {"a", "b", "c"}
+    assert drain(queue) == predicted
+
+
+def test_remove():
+    queue = FairQueue()
+    queue.push("a0", "a")
+    queue.push("a1", "a")
+    assert queue.remove("a0")
+    assert not queue.remove("missing")
+    assert len(queue) == 1
+    assert drain(queue) == ["a1"]
+
+
+def test_acting_as_sets_and_restores_identity():
+    assert identity() == (None, STANDARD)
+    with acting_as("a", BULK, background=True):
+        assert identity() == ("a", BULK) and in_background()
+        with acting_as("b", INTERACTIVE):
+            assert identity() == ("b", INTERACTIVE) and not in_background()
+        assert identity() == ("a", BULK) and in_background()
+    assert identity() == (None, STANDARD) and not in_background()
+
+
+def test_gate_times_out_and_forgets_the_waiter():
+    gate = FairGate(1)
+    ticket = gate.acquire()
+    assert gate.acquire(timeout=0.05) is None
+    assert gate.waiting() == 0
+    gate.release(ticket)
+    assert gate.acquire(timeout=0.05) is not None
+
+
+def test_gate_admits_waiters_fairly():
+    gate = FairGate(1, quota=1)
+    held = gate.acquire()
+    granted = []
+
+    def wait(owner, priority):
+        with acting_as(owner, priority):
+            ticket = gate.acquire(timeout=5)
+        granted.append(owner)
+        gate.release(ticket)
+
+    threads = []
+    for owner, priority in [("heavy", BULK), ("heavy", BULK), ("casual", INTERACTIVE)]:
+        thread = threading.Thread(target=wait, args=(owner, priority))
+        thread.start()
+        threads.append(thread)
+        # Queue them up in a known order
+        while gate.waiting() < len(threads):
+            time.sleep(0.001)
+    gate.release(held)
+    for thread in threads:
+        thread.join()
+    assert granted == ["casual", "heavy", "heavy"]
@@ -0,0 +1,32 @@
+import pytest
+
+from astro_enhancer.tiling import plan_tiles
+
+
+def test_small_image_is_one_tile():
+    assert plan_tiles(300, 200, 512, 32) == [(0, 0, 300, 200)]
+
+
+@pytest.mark.parametrize("width,height,tile_size,overlap", [
+    (1000, 1000, 512, 32),
+    (4096, 3000, 1024, 64),
+    (1025, 513, 512, 0),
+    (2000, 700, 700, 100),
+])
+def test_tiles_cover_the_image_with_enough_overlap(width, height, tile_size, overlap):
+    boxes = plan_tiles(width, height, tile_size, overlap)
+    lefts = sorted({box[0] for box in boxes})
+    tops = sorted({box[1] for box in boxes})
+    assert len(boxes) == len(lefts) * len(tops)
+    # Row-major order
+    assert boxes == sorted(boxes, key=lambda box: (box[1], box[0]))
+    for left, top, right, bottom in boxes:
+        assert right - left <= tile_size and bottom - top <= tile_size
+    # Flush with every edge
+    assert lefts[0] == 0 and tops[0] == 0
+    assert max(box[2] for box in boxes) == width
+    assert max(box[3] for box in boxes) == height
+    # Neighbours overlap by at least `overlap`, so there are no gaps
+    for starts in (lefts, tops):
+        for a, b in zip(starts, starts[1:]):
+            assert a + tile_size - b >= overlap
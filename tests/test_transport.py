@@ -0,0 +1,98 @@
+import base64
+import io
+import json
+
+import pytest
+
+from astro_enhancer.transport import MultipartBody, iter_multipart, parse_json, parse_multipart
+from bench.mock_backend import parse_form
+
+
+def make_body(data=b"\x89PNG image bytes" * 1000, progress=None, filename="m31.png"):
+    fileobj = io.BytesIO(b"ignored prefix" + data)
+    fileobj.seek(len(b"ignored prefix"))
+    return MultipartBody({"model_name": "SwinIR (4x)", "noise_level": 20.0}, "image", filename, fileobj,
+                         "image/png", progress)
+
+
+def test_multipart_body_is_a_valid_form():
+    data = b"\x89PNG image bytes" * 1000
+    body = make_body(data)
+    encoded = body.read()
+    assert len(encoded) == len(body) == body.total
+    assert body.file_size == len(data)
+    fields, files = parse_form(body.content_type, encoded)
+    assert fields == {"model_name": "SwinIR (4x)", "noise_level": "20.0"}
+    assert files == {"image": data}
+
+
+def test_multipart_body_streams_in_chunks_and_reports_progress():
+    reports = []
+    data = b"\x89PNG image bytes" * 10000
+    body = make_body(data, progress=lambda sent, total: reports.append((sent, total)))
+    chunks = list(body)
+    assert len(chunks) > 1
+    assert parse_form(body.content_type, b"".join(chunks))[1] == {"image": data}
+    assert reports[-1] == (body.total, body.total)
+    assert [sent for sent, _ in reports] == sorted(sent for sent, _ in reports)
+
+
+def test_multipart_body_rewinds_for_a_retry():
+    body = make_body()
+    first = body.read(100) + body.read()
+    body.rewind()
+    assert body.sent == 0
+    assert body.read() == first
+
+
+def test_multipart_body_quotes_filenames():
+    body = make_body(filename='odd"name.png')
+    assert b'filename="odd%22name.png"' in body.read()
+
+
+def test_multipart_body_fails_if_the_file_shrinks():
+    fileobj = io.BytesIO(b"x" * 100)
+    body = MultipartBody({}, "image", "x.png", fileobj, "image/png")
+    fileobj.truncate(10)
+    with pytest.raises(IOError):
+        body.read()
+
+
+def multipart_response(parts, boundary="frontier"):
+    body = b""
+    for headers, payload in parts:
+        body += f"--{boundary}\r\n".encode()
+        body += "".join(f"{k}: {v}\r\n" for k, v in headers.items()).encode() + b"\r\n"
+        body += payload + b"\r\n"
+    body += f"--{boundary}--\r\n".encode()
+    return f"multipart/mixed; boundary={boundary}", body
+
+
+def test_parse_multipart_response():
+    content_type, body = multipart_response([
+        ({"Content-Type": "application/json"}, json.dumps({"prompt_used": "a galaxy"}).encode()),
+        ({"Content-Type": "image/png", "Content-Disposition": 'attachment; name="enhanced_image"'},
+         b"\r\n--not-a-boundary\r\nbinary"),
+        ({"Content-Type": "image/png", "Content-Disposition": 'attachment; name="before_after_0"'}, b"before"),
+    ])
+    result = parse_multipart(content_type, body)
+    assert result == {"enhanced_image": b"\r\n--not-a-boundary\r\nbinary", "before_after": [b"before"],
+                      "prompt_used": "a galaxy"}
+
+
+def test_parse_multipart_rejects_bad_responses():
+    content_type, body = multipart_response([({"Content-Type": "application/json"}, b"{}")])
+    with pytest.raises(ValueError):
+        parse_multipart(content_type, body)
+    with pytest.raises(ValueError):
+        list(iter_multipart(content_type, body[:-20]))
+    with pytest.raises(ValueError):
+        list(iter_multipart("multipart/mixed", body))
+
+
+def test_parse_json_decodes_inline_images():
+    image = base64.b64encode(b"png").decode()
+    result = parse_json(json.dumps({"enhanced_image": f"data:image/png;base64,{image}",
+                                    "before_after": [image], "prompt_used": "p"}).encode())
+    assert result == {"enhanced_image": b"png", "before_after": [b"png"], "prompt_used": "p"}
+    assert parse_json(b'{"result_id": "abc"}') == {"result_id": "abc"}
@@ -0,0 +1,60 @@
+import io
+
+import pytest
+from PIL import Image, ImageCms, PngImagePlugin
+
+from astro_enhancer.upload import prepare_upload, stream_upload, strip_metadata
+
+ICC = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+
+
+def with_metadata(image_format):
+    exif = Image.Exif()
+    exif[0x010F] = "Camera maker"
+    # GPS IFD
+    exif[0x8825] = {1: "N", 2: (51.0, 28.0, 40.0)}
+    args = {"exif": exif.tobytes(), "icc_profile": ICC}
+    if image_format == "PNG":
+        args["pnginfo"] = PngImagePlugin.PngInfo()
+        args["pnginfo"].add_text("Comment", "taken from the back garden")
+    elif image_format == "WEBP":
+        args.update(lossless=True, xmp=b"<x:xmpmeta/>")
+    buffered = io.BytesIO()
+    Image.new("RGB", (40, 30), (10, 200, 30)).save(buffered, format=image_format, **args)
+    return buffered.getvalue()
+
+
+def assert_clean(data, original):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    assert not dict(image.getexif())
+    assert not {"comment", "Comment", "xmp", "XML:com.adobe.xmp"} & set(image.info)
+    assert image.info.get("icc_profile") == ICC
+    assert image.tobytes() == Image.open(io.BytesIO(original)).tobytes()
+
+
+@pytest.mark.parametrize("image_format", ["JPEG", "PNG", "WEBP"])
+def test_strip_metadata_keeps_pixels_and_colour_profile(image_format):
+    data = with_metadata(image_format)
+    fileobj = io.BytesIO(b"prefix" + data)
+    fileobj.seek(len(b"prefix"))
+    stripped = strip_metadata(fileobj, image_format).read()
+    assert len(stripped) < len(data)
+    assert_clean(stripped, data)
+
+
+@pytest.mark.parametrize("image_format", ["JPEG", "PNG", "WEBP"])
+def test_images_sent_as_they_are_lose_their_metadata(image_format):
+    data = with_metadata(image_format)
+    streamed = stream_upload(io.BytesIO(data), "garden.img", max_size=100)
+    sent = streamed.open().read()
+    assert streamed.sent_bytes == len(sent) and streamed.original_bytes == len(data)
+    assert_clean(sent, data)
+    assert_clean(prepare_upload(data, "garden.img", max_size=100).data, data)
+
+
+def test_files_without_metadata_are_streamed_unchanged():
+    buffered = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(buffered, format="PNG")
+    buffered.seek(0)
+    assert strip_metadata(buffered, "PNG") is buffered